@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+
+-------------------------------------------------
+   File Name:         BoxQP
+   Description :      上下限(box)约束 + 少量等式约束的二次规划: 加速投影梯度 + 精确投影
+   Author :           linhengyang
+   Create date:       2024/03/04
+   Latest version:    v1.0.0
+-------------------------------------------------
+
+"""
+
+import numpy as np
+import typing as t
+
+
+
+
+def box_eq_feasible(
+        low: np.ndarray,
+        high: np.ndarray,
+        rtn_rates: np.ndarray,
+        goal_r: np.floating
+        ) -> bool:
+    '''
+    check whether {low <= w <= high, ones @ w = 1, rtn_rates @ w = goal_r} is non-empty.
+    range of rtn_rates @ w over {box, ones @ w = 1} comes from a greedy fill:
+    start from w = low, fill the remaining budget 1 - sum(low) into assets by descending
+    (max) / ascending (min) rtn_rates, each up to high - low.
+    '''
+    budget = 1.0 - low.sum()
+    if budget < 0 or high.sum() < 1.0:
+        return False
+
+    def greedy_fill(order):
+        caps = (high - low)[order]
+        fill = np.clip(budget - np.concatenate([[0.], np.cumsum(caps)[:-1]]), 0, caps)
+        return rtn_rates @ low + rtn_rates[order] @ fill
+
+    order = np.argsort(-rtn_rates)
+    return greedy_fill(order[::-1]) <= goal_r <= greedy_fill(order)
+
+
+
+
+def project_box_eq(
+        v: np.ndarray,
+        low: np.ndarray,
+        high: np.ndarray,
+        eq_mat: np.ndarray,
+        eq_vec: np.ndarray,
+        dual_init: t.Union[np.ndarray, None] = None,
+        tol: float = 1e-11,
+        max_iter: int = 50
+        ) -> t.Tuple[np.ndarray, np.ndarray]:
+    '''
+    exact euclidean projection of v onto {low <= w <= high, eq_mat @ w = eq_vec},
+    eq_mat with shape (k, n) and k small (e.g. ones & rtn_rates, k=2).
+
+    w(lam) = clip(v - eq_mat.T @ lam, low, high) minimizes the lagrangian for fixed lam.
+    The dual D(lam) is concave, piecewise quadratic with gradient eq_mat @ w(lam) - eq_vec,
+    solved by semi-smooth newton on the k dual variables with exact line search.
+    Every iteration costs O(nk), memory O(n).
+
+    return:
+        w: projection
+        lam: dual variables, can be used as dual_init of the next close projection
+    '''
+    k = eq_mat.shape[0]
+    lam = np.zeros(k) if dual_init is None else dual_init.copy()
+
+    w = np.clip(v - eq_mat.T @ lam, low, high)
+    grad = eq_mat @ w - eq_vec
+    ridge = 1e-12 * (1.0 + np.sum(np.square(eq_mat)))
+
+    for _ in range(max_iter):
+        if np.max(np.abs(grad)) <= tol:
+            break
+
+        # 广义 Hessian: -eq_mat[:, free] @ eq_mat[:, free].T
+        free = (w > low) & (w < high)
+        eq_free = eq_mat[:, free]
+        step = np.linalg.solve(eq_free @ eq_free.T + ridge * np.eye(k), grad)
+
+        # 先试完整 newton 步; 梯度没有下降时(例如自由变量少于 k 个, Hessian 奇异, step 量级很大)
+        # 改用精确线搜索确定步长
+        w_try = np.clip(v - eq_mat.T @ (lam + step), low, high)
+        grad_try = eq_mat @ w_try - eq_vec
+        if np.max(np.abs(grad_try)) < np.max(np.abs(grad)):
+            lam, w, grad = lam + step, w_try, grad_try
+            continue
+
+        s = _exact_dual_line_search(v - eq_mat.T @ lam, eq_mat.T @ step,
+                                    low, high, grad @ step)
+        if s <= 0:
+            break
+
+        lam = lam + s * step
+        w = np.clip(v - eq_mat.T @ lam, low, high)
+        grad = eq_mat @ w - eq_vec
+
+    return w, lam
+
+
+
+
+def _exact_dual_line_search(
+        base: np.ndarray,
+        direc: np.ndarray,
+        low: np.ndarray,
+        high: np.ndarray,
+        slope_at_0: np.floating
+        ) -> np.floating:
+    '''
+    maximize the dual along lam + s * step, s >= 0.
+    with w(s) = clip(base - s * direc, low, high), the directional derivative is
+    phi'(s) = slope_at_0 + direc @ (w(s) - w(0)), piecewise linear and non-increasing in s.
+    Each w_i(s) is free (slope -direc_i^2) on one interval of s, so the root of phi'
+    comes from sorting the interval ends: O(n log n), no iteration.
+    '''
+    moving = direc != 0
+    base, direc, low, high = base[moving], direc[moving], low[moving], high[moving]
+
+    s_a, s_b = (base - low) / direc, (base - high) / direc
+    s_enter, s_leave = np.minimum(s_a, s_b), np.maximum(s_a, s_b)
+
+    active = s_leave > 0
+    s_enter, s_leave, sq = np.maximum(s_enter[active], 0.0), s_leave[active], np.square(direc[active])
+
+    # 事件: s_enter 处斜率 -direc^2 开始, s_leave 处结束
+    events = np.concatenate([s_enter, s_leave])
+    dslope = np.concatenate([-sq, sq])
+    order = np.argsort(events, kind='stable')
+    events, dslope = events[order], dslope[order]
+
+    slopes = np.cumsum(dslope) # 每个事件之后的斜率
+    gaps = np.diff(events, prepend=0.0)
+    values = slope_at_0 + np.cumsum( np.concatenate([[0.], slopes[:-1]]) * gaps ) # 每个事件处的 phi'
+
+    cross = np.where(values <= 0)[0]
+    if len(cross) == 0:
+        # 所有事件之后 phi' 仍为正且斜率为0: 对偶无界(原问题不可行), 走到最后一个事件
+        return events[-1] if len(events) else 0.0
+
+    j = cross[0]
+    if j == 0:
+        return events[0] if values[0] == 0 else 0.0
+
+    # 在 [events[j-1], events[j]] 之间线性插值求根
+    return events[j-1] + values[j-1] / (values[j-1] - values[j]) * gaps[j]
+
+
+
+
+def solve_box_qp(
+        cov_mat: np.ndarray,
+        rtn_rates: np.ndarray,
+        goal_r: np.floating,
+        low: np.ndarray,
+        high: np.ndarray,
+        w0: t.Union[np.ndarray, None] = None,
+        tol: float = 1e-9,
+        max_iter: int = 20000
+        ) -> dict:
+    '''
+    Minimize 1/2 * w @ cov_mat @ w
+    subject to rtn_rates @ w = goal_r, ones @ w = 1, low <= w <= high
+
+    accelerated projected gradient (FISTA) with adaptive restart, every step projected
+    exactly onto the feasible set by project_box_eq. Constraints only cost O(n) memory,
+    no 2n x n inequality matrix is built.
+
+    w0: optional warm start, e.g. the solution of the previous rolling window
+
+    return: (same keys as cvxopt.solvers.qp where meaningful)
+    {
+        'x': np.ndarray
+        'status': 'optimal' | 'infeasible' | 'unknown'
+        'iterations': int
+        'primal objective': np.floating
+    }
+    '''
+    num = len(rtn_rates)
+
+    if not box_eq_feasible(low, high, rtn_rates, goal_r):
+        return {'x': np.full(num, np.nan), 'status': 'infeasible',
+                'iterations': 0, 'primal objective': np.nan}
+
+    eq_mat = np.stack([np.ones(num), rtn_rates], axis=0)
+    eq_vec = np.array([1.0, goal_r])
+
+    # 步长 1/L, L 为 cov_mat 的最大特征值, 幂迭代估计
+    u = np.ones(num) / np.sqrt(num)
+    for _ in range(50):
+        u = cov_mat @ u
+        u /= np.linalg.norm(u)
+    lipschitz = 1.01 * (u @ cov_mat @ u)
+
+    start = np.full(num, 1.0 / num) if w0 is None else np.asarray(w0, dtype=np.float64).reshape(-1)
+    x, lam = project_box_eq(start, low, high, eq_mat, eq_vec)
+    y, theta = x.copy(), 1.0
+    status, iterations = 'unknown', max_iter
+
+    for i in range(max_iter):
+        x_new, lam = project_box_eq(y - cov_mat @ y / lipschitz, low, high,
+                                    eq_mat, eq_vec, dual_init=lam)
+
+        if np.linalg.norm(x_new - x) <= tol * max(1.0, np.linalg.norm(x)):
+            x, status, iterations = x_new, 'optimal', i + 1
+            break
+
+        # 梯度映射方向与动量方向相反时重置动量(adaptive restart)
+        if (y - x_new) @ (x_new - x) > 0:
+            theta = 1.0
+        theta_new = (1.0 + np.sqrt(1.0 + 4.0 * theta**2)) / 2.0
+        y = x_new + (theta - 1.0) / theta_new * (x_new - x)
+        x, theta = x_new, theta_new
+
+    # 投影未能满足等式约束时, 不报告 optimal
+    if np.max(np.abs(eq_mat @ x - eq_vec)) > 1e-7:
+        status = 'unknown'
+
+    return {'x': x, 'status': status, 'iterations': iterations,
+            'primal objective': 0.5 * x @ cov_mat @ x}
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+
+-------------------------------------------------
+   File Name:         CriticalLine
+   Description :      临界线算法(Critical Line Algorithm): 一次求出上下限约束下有效前沿的全部角点组合
+   Author :           linhengyang
+   Create date:       2024/03/06
+   Latest version:    v1.0.0
+-------------------------------------------------
+
+"""
+
+import numpy as np
+import typing as t
+from Code.Utils.Type import (
+    basicPortfSolveRes,
+    frontierPortfSolveRes
+    )
+
+
+
+
+## 临界线算法求解器
+class CriticalLineOpt:
+    '''
+    Minimize 1/2 * w @ V @ w - lam * rtn @ w
+    subject to ones @ w = 1, low <= w <= high
+
+    When lam goes down from +inf to 0, the optimal w moves along the bounded efficient frontier,
+    from the max-return portfolio to the min-variance portfolio. Between two adjacent corner
+    portfolios the free asset set does not change, so w is linear in the portfolio return r,
+    and the portfolio variance is quadratic in r.
+
+    All corner portfolios are computed once in __init__. After that, every minWave / maxReturn
+    query is a binary search over the corners plus an interpolation on one segment.
+    A minWave target outside [min-variance corner, max-return corner] return, or a maxReturn target
+    below the min-variance corner variance, is off the bounded efficient frontier: its result is nan
+    with solve_status 'cla_infeasible', the way the box backend reports 'box_infeasible'.
+
+    attributes:
+        1. corner_w: shape (num_corners, num_assets), sorted by return ascending
+        2. corner_rtn
+        3. corner_var
+    methods:
+        1. __call__(tgt_value, mode)
+        2. frontier(tgt_values, mode)
+    '''
+
+    __slots__ = ("assets_idlst", "__expct_rtn_rates", "__expct_cov_mat", "__low_constraints",
+                 "__high_constraints", "__num_assets", "__corner_w", "__corner_rtn", "__corner_var",
+                 "__corner_cross_var", "__corner_lam")
+
+
+    def __init__(
+            self,
+            expct_rtn_rates: np.ndarray,
+            expct_cov_mat: np.ndarray,
+            constraints: t.List[np.ndarray],
+            assets_idlst: list = [],
+            tol: float = 1e-10
+            ) -> None:
+
+        self.assets_idlst = assets_idlst # 记录资产的排列
+        self.__low_constraints, self.__high_constraints = constraints
+
+        assert self.__low_constraints is not None and self.__high_constraints is not None, \
+            "critical line algorithm needs both low & high constraints"
+
+        assert len(expct_rtn_rates) == expct_cov_mat.shape[0],\
+            "Assets number conflicts between returns & covariance"
+
+        assert self.__low_constraints.sum() <= 1.0 <= self.__high_constraints.sum(), \
+            "no portfolio satisfies ones @ w = 1 under the low & high constraints"
+
+        self.__expct_rtn_rates = np.asarray(expct_rtn_rates, dtype=np.float64)
+        self.__expct_cov_mat = np.asarray(expct_cov_mat, dtype=np.float64)
+        self.__num_assets = len(expct_rtn_rates)
+
+        self.__build_corners(tol)
+
+
+    def __init_portf(self) -> t.Tuple[np.ndarray, np.ndarray]:
+        # lam = +inf 时的最优解即最大收益组合: 从下限出发, 按预期收益率从高到低依次填到上限,
+        # 预算用完时所在的资产为唯一的自由资产
+        low, high = self.__low_constraints, self.__high_constraints
+        order = np.argsort(-self.__expct_rtn_rates, kind='stable')
+
+        w = low.astype(np.float64).copy()
+        budget = 1.0 - w.sum()
+        for i in order:
+            add = min(high[i] - low[i], budget)
+            w[i] += add
+            budget -= add
+            if budget <= 0:
+                break
+
+        free = np.zeros(self.__num_assets, dtype=bool)
+        free[i] = True
+
+        return w, free
+
+
+    def __segment(
+            self,
+            w: np.ndarray,
+            free: np.ndarray
+            ) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        free set F, bounded set B 不变时, 最优解关于 lam 是仿射的:
+            w_F(lam) = alpha + lam * beta
+            gamma(lam) = gamma_0 + lam * gamma_1 (ones @ w = 1 的乘子)
+        B 中资产的 KKT 乘子 g_B(lam) = V_B @ w(lam) - lam * rtn_B - gamma(lam), 同样是仿射的
+        return: alpha, beta, (g_0, g_1) 的 g_B 常数项与 lam 系数
+        '''
+        V, rtn = self.__expct_cov_mat, self.__expct_rtn_rates
+        bnd = ~free
+
+        w_b = w[bnd]
+        cov_ff = V[np.ix_(free, free)]
+        cov_fb_wb = V[np.ix_(free, bnd)] @ w_b
+
+        # 一次求解 V_FF^{-1} @ [ones, rtn_F, V_FB @ w_B]
+        inv_ones, inv_rtn, inv_fixed = np.linalg.solve(
+            cov_ff,
+            np.stack([np.ones(free.sum()), rtn[free], cov_fb_wb], axis=1)
+            ).T
+
+        quad = inv_ones.sum()
+        gamma_0 = (1.0 - w_b.sum() + inv_fixed.sum()) / quad
+        gamma_1 = - inv_rtn.sum() / quad
+
+        alpha = gamma_0 * inv_ones - inv_fixed
+        beta = inv_rtn + gamma_1 * inv_ones
+
+        # B 中资产的乘子: 下限处须 >= 0, 上限处须 <= 0
+        cov_bf, cov_bb_wb = V[np.ix_(bnd, free)], V[np.ix_(bnd, bnd)] @ w_b
+        g_0 = cov_bf @ alpha + cov_bb_wb - gamma_0
+        g_1 = cov_bf @ beta - rtn[bnd] - gamma_1
+
+        return alpha, beta, g_0, g_1
+
+
+    def __build_corners(self, tol: float) -> None:
+        # 从最大收益组合出发, lam 逐段下降, 每一段只有一个资产进入或离开 free set
+        low, high = self.__low_constraints, self.__high_constraints
+
+        w, free = self.__init_portf()
+        lam, last_moved = np.inf, -1
+        corners, lams = [w.copy()], [lam]
+
+        for _ in range(10 * self.__num_assets + 10):
+            alpha, beta, g_0, g_1 = self.__segment(w, free)
+            free_idx, bnd_idx = np.where(free)[0], np.where(~free)[0]
+
+            # 情况a: 自由资产触及上下限. beta > 0 时随lam下降而减小, 触及下限; 反之触及上限
+            with np.errstate(divide='ignore', invalid='ignore'):
+                hit = np.where(beta > tol, (low[free] - alpha) / beta,
+                               np.where(beta < -tol, (high[free] - alpha) / beta, -np.inf))
+                # 情况b: 边界资产的乘子穿过0, 离开边界成为自由资产
+                leave = np.where(np.abs(g_1) > tol, -g_0 / g_1, -np.inf)
+
+            # 一个资产只剩自由时不能离开 free set
+            if len(free_idx) == 1:
+                hit[:] = -np.inf
+
+            # 只取 lam 以下的事件(允许数值误差内相等, 处理多个资产同时变化);
+            # 刚变化的资产须严格低于 lam, 避免在同一点来回进出
+            lam_ceil = lam * (1 + tol) + tol if np.isfinite(lam) else np.inf
+            lam_floor = lam * (1 - tol) - tol if np.isfinite(lam) else np.inf
+            hit[~(hit < np.where(free_idx == last_moved, lam_floor, lam_ceil))] = -np.inf
+            leave[~(leave < np.where(bnd_idx == last_moved, lam_floor, lam_ceil))] = -np.inf
+
+            lam_hit = hit.max() if len(hit) else -np.inf
+            lam_leave = leave.max() if len(leave) else -np.inf
+            lam_next = max(lam_hit, lam_leave)
+
+            if lam_next <= 0:
+                # 之后不再有角点, lam = 0 时为最小方差组合
+                w[free] = alpha
+                corners.append(w.copy())
+                lams.append(0.0)
+                break
+
+            w[free] = alpha + lam_next * beta
+            if lam_hit >= lam_leave:
+                i = free_idx[np.argmax(hit)]
+                w[i] = low[i] if beta[np.argmax(hit)] > 0 else high[i]
+                free[i] = False
+            else:
+                i = bnd_idx[np.argmax(leave)]
+                free[i] = True
+
+            lam, last_moved = lam_next, i
+            corners.append(w.copy())
+            lams.append(lam)
+
+        # 按收益率从低到高排列(lam 从0到+inf), 去掉长度为0的段
+        corner_w = np.stack(corners[::-1], axis=0)
+        corner_rtn = corner_w @ self.__expct_rtn_rates
+        keep = np.concatenate([[True], np.diff(corner_rtn) > tol * max(1.0, np.abs(corner_rtn).max())])
+
+        self.__corner_w = corner_w[keep]
+        self.__corner_rtn = corner_rtn[keep]
+        self.__corner_lam = np.array(lams[::-1])[keep]
+        self.__corner_var = np.einsum('ki,ij,kj->k', self.__corner_w, self.__expct_cov_mat, self.__corner_w)
+        # 相邻角点的协方差 w_k @ V @ w_{k+1}, 段内方差是插值系数的二次函数
+        self.__corner_cross_var = np.einsum('ki,ij,kj->k', self.__corner_w[:-1],
+                                            self.__expct_cov_mat, self.__corner_w[1:])
+
+
+    @property
+    def corner_w(self) -> np.ndarray:
+        return self.__corner_w
+
+    @property
+    def corner_rtn(self) -> np.ndarray:
+        return self.__corner_rtn
+
+    @property
+    def corner_var(self) -> np.ndarray:
+        return self.__corner_var
+
+    @property
+    def corner_lam(self) -> np.ndarray:
+        return self.__corner_lam
+
+
+    def __interp(
+            self,
+            seg: np.ndarray,
+            frac: np.ndarray
+            ) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # 第 seg 段上, 插值系数为 frac 处的权重/收益率/方差
+        w_0, w_1 = self.__corner_w[seg], self.__corner_w[seg+1]
+        var_0, var_1, cross = self.__corner_var[seg], self.__corner_var[seg+1], self.__corner_cross_var[seg]
+
+        portf_w = w_0 + frac[..., None] * (w_1 - w_0)
+        portf_rtn = portf_w @ self.__expct_rtn_rates
+        portf_var = (1-frac)**2 * var_0 + 2 * frac * (1-frac) * cross + frac**2 * var_1
+
+        return portf_w, portf_rtn, portf_var
+
+
+    def __locate_rtn(self, goal_r: np.ndarray) -> t.Tuple[np.ndarray, np.ndarray]:
+        # 二分查找 goal_r 所在的段, 段内权重对收益率线性插值
+        rtn = self.__corner_rtn
+
+        # 有效前沿之外(低于约束下最小方差组合, 或高于最大收益组合)的目标收益率由 frontier 标记为 'cla_infeasible'
+        goal_r = np.clip(goal_r, rtn[0], rtn[-1])
+
+        if len(rtn) == 1:
+            return np.zeros(goal_r.shape, dtype=int), np.zeros(goal_r.shape)
+
+        seg = np.clip(np.searchsorted(rtn, goal_r, side='right') - 1, 0, len(rtn) - 2)
+        frac = (goal_r - rtn[seg]) / (rtn[seg+1] - rtn[seg])
+
+        return seg, frac
+
+
+    def __locate_var(self, goal_var: np.ndarray) -> t.Tuple[np.ndarray, np.ndarray]:
+        # 有效前沿上方差随收益率单调增加. 二分查找 goal_var 所在的段, 段内解一元二次方程;
+        # 超过最大收益组合的方差时, 方差约束不起作用, 取最大收益组合
+        var = self.__corner_var
+
+        # 低于约束下最小方差的目标方差由 frontier 标记为 'cla_infeasible'
+        goal_var = np.clip(goal_var, var[0], var[-1])
+
+        if len(var) == 1:
+            return np.zeros(goal_var.shape, dtype=int), np.zeros(goal_var.shape)
+
+        seg = np.clip(np.searchsorted(var, goal_var, side='right') - 1, 0, len(var) - 2)
+
+        # var(f) = var_0 + 2 f (cross - var_0) + f^2 (var_0 - 2 cross + var_1), f in [0, 1]
+        var_0, var_1, cross = var[seg], var[seg+1], self.__corner_cross_var[seg]
+        qa, qb, qc = var_0 - 2 * cross + var_1, cross - var_0, var_0 - goal_var
+        with np.errstate(divide='ignore', invalid='ignore'):
+            root = (-qb + np.sqrt(np.maximum(qb**2 - qa * qc, 0.0))) / qa
+            frac = np.where(np.abs(qa) > 1e-14, root, -qc / (2 * qb))
+
+        return seg, np.clip(frac, 0.0, 1.0)
+
+
+    def __call__(
+            self,
+            tgt_value: np.floating,
+            mode: str) -> basicPortfSolveRes:
+        '''
+        mode:
+            minWave: tgt_value 为预期收益率r, 求波动最小的portfolio
+            maxReturn: tgt_value 为能承受的波动var, 求预期收益最大的portfolio
+        '''
+        res = self.frontier(np.array([tgt_value]), mode)
+
+        return {
+            'portf_w': res['portf_w'][0],
+            'portf_rtn': res['portf_rtn'][0],
+            'portf_var': res['portf_var'][0],
+            'solve_status': res['solve_status'][0],
+            'assets_idlst': self.assets_idlst,
+            'qp_iterations': 0
+            }
+
+
+    def frontier(
+            self,
+            tgt_values: np.ndarray,
+            mode: str) -> frontierPortfSolveRes:
+        '''
+        query a batch of targets on the corners, O(log k + n) each
+        return: frontierPortfSolveRes
+        '''
+        if mode not in ['minWave', 'maxReturn']:
+            raise ValueError(
+                f'wrong mode for critical line algorithm with {mode}'
+                )
+
+        tgt_values = np.asarray(tgt_values, dtype=np.float64).reshape(-1)
+
+        if mode == 'minWave':
+            seg, frac = self.__locate_rtn(tgt_values)
+            # 与 box 后端的 'box_infeasible' 一致, 有效前沿之外的目标值返回 nan 与不可行状态, 不报错
+            infeasible = (tgt_values < self.__corner_rtn[0]) | (tgt_values > self.__corner_rtn[-1])
+        else:
+            seg, frac = self.__locate_var(tgt_values)
+            infeasible = tgt_values < self.__corner_var[0]
+
+        if len(self.__corner_w) == 1:
+            portf_w = np.repeat(self.__corner_w, len(tgt_values), axis=0)
+            portf_rtn = np.repeat(self.__corner_rtn, len(tgt_values))
+            portf_var = np.repeat(self.__corner_var, len(tgt_values))
+        else:
+            portf_w, portf_rtn, portf_var = self.__interp(seg, frac)
+
+        portf_w[infeasible], portf_rtn[infeasible], portf_var[infeasible] = np.nan, np.nan, np.nan
+
+        return {
+            'portf_w': portf_w,
+            'portf_rtn': portf_rtn,
+            'portf_var': portf_var,
+            'solve_status': ['cla_infeasible' if flag else 'cla_optimal' for flag in infeasible],
+            'assets_idlst': self.assets_idlst
+            }
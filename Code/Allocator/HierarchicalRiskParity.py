@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+
+-------------------------------------------------
+   File Name:         HierarchicalRiskParity
+   Description :      分层风险平价(HRP): 相关性距离聚类 + 准对角化 + 递归二分, 不需要求逆与优化器
+   Author :           linhengyang
+   Create date:       2024/03/12
+   Latest version:    v1.0.0
+-------------------------------------------------
+
+"""
+
+import numpy as np
+import typing as t
+from scipy.cluster.hierarchy import linkage, leaves_list
+from scipy.spatial.distance import squareform
+from Code.Utils.Statistic import cov2corr_mat
+from Code.Utils.Type import riskParitySolveRes
+
+
+
+
+## 分层风险平价
+class HierarchicalRiskParity:
+    '''
+    Hierarchical Risk Parity (Lopez de Prado, 2016)
+
+    1. tree clustering on correlation distance d_ij = sqrt( (1 - corr_ij) / 2 )
+    2. quasi-diagonalization: reorder assets by the leaves of the dendrogram,
+       so that similar assets sit next to each other in the covariance
+    3. recursive bisection: split every cluster of the ordered list into two halves,
+       and allocate between the halves by the inverse of their inverse-variance portfolio variance
+
+    Only the diagonal of the covariance is inverted, no linear system & no optimizer is needed,
+    so it is robust to singular covariance and runs in O(n^2 log n) for thousands of assets.
+
+    attributes:
+        1. order: quasi-diagonal order of assets
+        2. link: scipy linkage matrix
+    methods:
+        1. __call__()
+    '''
+
+    __slots__ = ("assets_idlst", "__expct_rtn_rates", "__expct_cov_mat", "__num_assets",
+                 "__order", "__link", "__portf_w")
+
+
+    def __init__(
+            self,
+            expct_rtn_rates: np.ndarray,
+            expct_cov_mat: np.ndarray,
+            assets_idlst: list = [],
+            linkage_method: str = 'single'
+            ) -> None:
+
+        self.assets_idlst = assets_idlst # 记录资产的排列
+
+        # 带 to_dense() 的协方差对象(如 factorCovariance) 转为稠密矩阵
+        if hasattr(expct_cov_mat, 'to_dense'):
+            expct_cov_mat = expct_cov_mat.to_dense()
+
+        assert len(expct_rtn_rates) == expct_cov_mat.shape[0],\
+            "Assets number conflicts between returns & covariance"
+
+        self.__expct_rtn_rates = np.asarray(expct_rtn_rates, dtype=np.float64)
+        self.__expct_cov_mat = np.asarray(expct_cov_mat, dtype=np.float64)
+        self.__num_assets = len(expct_rtn_rates)
+
+        assert all(np.diag(self.__expct_cov_mat) > 0), \
+            "all assets must have positive variance for hierarchical risk parity"
+
+        self.__cluster(linkage_method)
+        self.__portf_w = self.__bisection()
+
+
+    def __cluster(self, linkage_method: str) -> None:
+        # 相关性距离, 数值误差可能使 1 - corr 略小于 0
+        corr = cov2corr_mat(self.__expct_cov_mat)
+        dist = np.sqrt( np.clip( (1.0 - corr) / 2.0, 0.0, None ) )
+        np.fill_diagonal(dist, 0.0)
+
+        if self.__num_assets == 1:
+            self.__link, self.__order = np.empty((0, 4)), np.array([0])
+            return
+
+        self.__link = linkage(squareform(dist, checks=False), method=linkage_method)
+        self.__order = leaves_list(self.__link)
+
+
+    def __cluster_var(self, members: np.ndarray) -> np.floating:
+        # 簇内按方差倒数分配(inverse-variance portfolio)后的簇方差
+        cov = self.__expct_cov_mat[np.ix_(members, members)]
+        ivp = 1.0 / np.diag(cov)
+        ivp /= ivp.sum()
+        return ivp @ cov @ ivp
+
+
+    def __bisection(self) -> np.ndarray:
+        w = np.ones(self.__num_assets)
+
+        # 逐层二分: 每一层所有簇的方差计算共 O(n^2), 共 O(log n) 层
+        clusters = [self.__order]
+        while clusters:
+            next_clusters = []
+            for members in clusters:
+                if len(members) <= 1:
+                    continue
+                half = len(members) // 2
+                left, right = members[:half], members[half:]
+
+                var_left, var_right = self.__cluster_var(left), self.__cluster_var(right)
+                alpha = 1.0 - var_left / (var_left + var_right)
+
+                w[left] *= alpha
+                w[right] *= 1.0 - alpha
+                next_clusters += [left, right]
+
+            clusters = next_clusters
+
+        return w
+
+
+    @property
+    def order(self) -> np.ndarray:
+        return self.__order
+
+
+    @property
+    def link(self) -> np.ndarray:
+        return self.__link
+
+
+    def __call__(self) -> riskParitySolveRes:
+        w = self.__portf_w
+        cov_w = self.__expct_cov_mat @ w
+
+        return {'portf_w': w, 'portf_rtn': w @ self.__expct_rtn_rates, 'portf_var': w @ cov_w,
+                'risk_contribs': w * cov_w, 'solve_status': 'direct', 'assets_idlst': self.assets_idlst}
@@ -14,9 +14,16 @@
 import numpy as np
 import cvxopt
 import typing as t
-from Code.Utils.Type import basicPortfSolveRes
-from Code.Utils.Statistic import (
-    multiCoLinear
+from Code.Utils.Type import (
+    basicPortfSolveRes,
+    frontierPortfSolveRes
+    )
+from Code.Allocator.BoxQP import solve_box_qp
+from Code.Allocator.CriticalLine import CriticalLineOpt
+from Code.Utils.LinAlg import (
+    covFactorization,
+    factorCovariance,
+    batch_cov_solve
     )
 ## 均值-方差最优化求解器
 class MeanVarOpt:
@@ -29,6 +36,7 @@ class MeanVarOpt:
         'portf_var': np.floating
         'solve_status': str
         'assets_idlst': list
+        'qp_iterations': int
     }
     '''
 
@@ -36,46 +44,92 @@ class MeanVarOpt:
     __slots__ = ("assets_idlst", "__low_constraints", "__high_constraints",
                  "__no_bounds", "__expct_rtn_rates", "__expct_cov_mat", 
                  "__solve_status", "__portf_w", "__portf_var", "__portf_rtn", 
-                 "__cov_mat_inv", "__quad_term", "__const_term", "__lin_term", 
+                 "__cov_factor", "__cov_inv_ones", "__cov_inv_rtn", "__quad_term", "__const_term", "__lin_term", 
                  "__norm_term", "__vertex", "__num_assets",
-                 "__P", "__q", "__A", "__G", "__h", "__b")
+                 "__P", "__q", "__A", "__G", "__h", "__b", "__qp_args",
+                 "__qp_solution", "__qp_iterations", "__qp_backend", "__qp_prefix", "__cla",
+                 "__group_constraints", "__num_aux")
 
 
     def __init__(
             self,
             expct_rtn_rates: np.ndarray,
-            expct_cov_mat: np.ndarray,
+            expct_cov_mat: t.Union[np.ndarray, factorCovariance],
             constraints: t.List[t.Union[np.ndarray, None]],
-            assets_idlst: list
+            assets_idlst: list,
+            ineq_qp_args: t.Union[list, None] = None,
+            qp_backend: str = 'cvxopt',
+            group_constraints: t.Union[list, None] = None
             ) -> None:
-        
+        '''
+        expct_cov_mat: 稠密协方差矩阵, 或因子模型协方差 factorCovariance (B @ F @ B.T + D).
+            因子模型下闭式解用 Woodbury 公式, 二次规划引入因子暴露辅助变量, 每次迭代 O(nk^2),
+            有约束的 maxReturn 改为对目标收益率求根的一串二次规划. cla 后端仍需稠密矩阵
+        ineq_qp_args: 可选, 由 build_ineq_qp_args(constraints, group_constraints) 预先构建的 [G, h].
+            滚动窗口中约束不变, 传入后各窗口复用, 不再重复构建
+        qp_backend: 有上下限约束时 minWave 二次规划的求解器
+            'cvxopt': 内点法, 不等式约束为稀疏矩阵
+            'box': 加速投影梯度 + 精确投影(BoxQP), 约束只占 O(n) 内存, 适合大规模资产
+            'cla': 临界线算法(CriticalLine), 首次求解时算出全部角点组合, 之后 minWave / maxReturn
+                的每次求解只是二分查找 + 插值, 适合同一窗口多个目标值
+            maxReturn 模式使用二阶锥规划(cla 后端除外), sharp 模式始终使用 cvxopt
+        group_constraints: 可选, 类别/资产组的权重之和上下限 [member_lst, low, high],
+            member_lst 为各组资产位置的列表, low / high 为 nan 时该方向无约束. 只支持 cvxopt 后端
+        '''
+        if qp_backend not in ['cvxopt', 'box', 'cla']:
+            raise ValueError(
+                f'wrong qp backend for mean-variance optimal with {qp_backend}'
+                )
+        self.__qp_backend = qp_backend
+        self.__qp_prefix = {'box': 'box_', 'cla': 'cla_'}.get(qp_backend, 'qp_') # 求解状态前缀
+        self.__cla: t.Union[CriticalLineOpt, None] = None # 角点组合, 首次使用时计算
+
+        if group_constraints is not None and qp_backend != 'cvxopt':
+            raise ValueError(
+                f'group constraints are not supported by qp backend {qp_backend}'
+                )
+        self.__group_constraints = group_constraints
+
         self.assets_idlst = assets_idlst # 记录资产的排列
         # 下限，上限
-        self.__low_constraints, self.__high_constraints = constraints
+        self.__low_constraints, self.__high_constraints = [
+            None if bound is None else np.asarray(bound, dtype=np.float64) for bound in constraints ]
         
-        self.__no_bounds = self.__low_constraints is None and self.__high_constraints is None
+        self.__no_bounds = self.__low_constraints is None and self.__high_constraints is None and \
+            self.__group_constraints is None
 
         # 检查条件0: 预期收益率向量长度等于协方差矩阵的维度
         assert len(expct_rtn_rates) == expct_cov_mat.shape[0],\
             "Assets number conflicts between returns & covariance"
         
-        # 检查条件1: 共线性检查
-        colinear = multiCoLinear(expct_cov_mat, assets_idlst)
-        assert len(colinear) == 0, \
-            f'Co-Linearity found with assets {str(colinear)}'
+        # 协方差矩阵只分解一次, 之后所有 V^{-1} @ x 都复用该分解. 因子模型本身即可求解
+        self.__cov_factor = expct_cov_mat if isinstance(expct_cov_mat, factorCovariance) \
+            else covFactorization(expct_cov_mat)
+        # 因子模型下二次规划的辅助变量(因子暴露)个数
+        self.__num_aux = expct_cov_mat.scaled_loadings.shape[1] \
+            if isinstance(expct_cov_mat, factorCovariance) else 0
 
+        # 检查条件1: 共线性检查. 由分解的主元判断, 主元接近0的资产与其他资产线性相关
+        assert not self.__cov_factor.is_singular, \
+            f'Co-Linearity found with assets ' \
+            f'{str(np.array(assets_idlst)[self.__cov_factor.singular_idx]) if assets_idlst else self.__cov_factor.singular_idx}'
 
-        self.__expct_rtn_rates: np.ndarray = expct_rtn_rates
-        self.__expct_cov_mat: np.ndarray = expct_cov_mat
+
+        # 取数得到的是 float32, 各后端(闭式解/cvxopt/box/cla)的结果统一为 float64
+        self.__expct_rtn_rates: np.ndarray = np.asarray(expct_rtn_rates, dtype=np.float64)
+        self.__expct_cov_mat: t.Union[np.ndarray, factorCovariance] = expct_cov_mat \
+            if isinstance(expct_cov_mat, factorCovariance) else np.asarray(expct_cov_mat, dtype=np.float64)
 
         self.__build_quad_curve() # 已经足够画出mean-var曲线
 
-        self.__build_quad_program()
+        self.__build_quad_program(ineq_qp_args)
         self.__solve_status: str = "" # 求解状态
+        self.__qp_solution: t.Union[dict, None] = None # 二次规划的primal/dual解, 可作为下次求解的初始值
+        self.__qp_iterations: int = 0 # 二次规划迭代次数
 
         self.__portf_w: np.ndarray = np.array([]) # portfolio 实际权重 待求解
-        self.__portf_var: np.floating = np.float32(-1) # porfolio 实际var 待求解
-        self.__portf_rtn: np.floating = np.float32(0) # porfolio 实际rtn 待求解
+        self.__portf_var: np.floating = np.float64(-1) # porfolio 实际var 待求解
+        self.__portf_rtn: np.floating = np.float64(0) # porfolio 实际rtn 待求解
 
 
     def __build_quad_curve(self) -> None:
@@ -89,13 +143,14 @@ class MeanVarOpt:
         b = cons_term
         '''
 
-        self.__cov_mat_inv = np.linalg.inv(self.__expct_cov_mat)
         ones = np.ones_like(self.__expct_rtn_rates)
-        self.__quad_term = ones @ self.__cov_mat_inv @ ones
-        self.__const_term = self.__expct_rtn_rates @ \
-                            self.__cov_mat_inv @ \
-                            self.__expct_rtn_rates
-        self.__lin_term = ones @ self.__cov_mat_inv @ self.__expct_rtn_rates
+        # 一次求解 V^{-1} @ [ones, rtn], 之后 a/b/c/d 与权重公式都只需要向量内积
+        self.__cov_inv_ones, self.__cov_inv_rtn = self.__cov_factor.solve(
+            np.stack([ones, self.__expct_rtn_rates], axis=1)
+            ).T
+        self.__quad_term = ones @ self.__cov_inv_ones
+        self.__const_term = self.__expct_rtn_rates @ self.__cov_inv_rtn
+        self.__lin_term = ones @ self.__cov_inv_rtn
         self.__norm_term = self.__const_term*self.__quad_term -\
                             np.power(self.__lin_term, 2)
         
@@ -104,48 +159,146 @@ class MeanVarOpt:
                          self.__lin_term/self.__quad_term)
         
 
-    def __build_quad_program(self) -> None:
+    @staticmethod
+    def __ineq_triplets(
+        constraints: t.List[t.Union[np.ndarray, None]],
+        group_constraints: t.Union[list, None] = None
+        ) -> t.Tuple[list, list, list, list]:
+        '''
+        不等式约束 G @ x <= h 中 G 的稀疏三元组 (values, rows, cols) 与 h:
+        1、下限 -x_i <= -low_i, 2、上限 x_i <= high_i,
+        3、组下限 -sum(x_g) <= -low_g, 4、组上限 sum(x_g) <= high_g (nan 的一侧不构建)
+        非零元个数为 2n + 组内资产数之和, 与资产数成线性
+        '''
+        values, rows, cols, h = [], [], [], []
+
+        def add_rows(members_lst, sign, bounds):
+            for members, bound in zip(members_lst, bounds):
+                if np.isnan(bound):
+                    continue
+                values.extend( [sign] * len(members) )
+                rows.extend( [len(h)] * len(members) )
+                cols.extend( members )
+                h.append( sign * bound )
+
+        low_constraints, high_constraints = constraints
+
+        if low_constraints is not None:
+            add_rows([[i] for i in range(len(low_constraints))], -1.0, low_constraints)
+        if high_constraints is not None:
+            add_rows([[i] for i in range(len(high_constraints))], 1.0, high_constraints)
+
+        if group_constraints is not None:
+            member_lst, group_low, group_high = group_constraints
+            member_lst = [np.asarray(members).tolist() for members in member_lst]
+            add_rows(member_lst, -1.0, group_low)
+            add_rows(member_lst, 1.0, group_high)
+
+        return values, rows, cols, h
+
+
+    @staticmethod
+    def build_ineq_qp_args(
+        constraints: t.List[t.Union[np.ndarray, None]],
+        group_constraints: t.Union[list, None] = None,
+        num_assets: t.Union[int, None] = None
+        ) -> t.List[t.Union[cvxopt.spmatrix, cvxopt.matrix, None]]:
+        '''
+        二次规划-不等式约束 G @ x <= h 的 cvxopt 参数 [G, h]. G 为稀疏矩阵 cvxopt.spmatrix
+        不等式约束: 1、下限，2、上限，3、类别/资产组的上下限
+        都未给时，默认为无不等式约束, 返回 [None, None]
+        num_assets: 只有组约束、没有上下限时, 须给出资产数
+        '''
+        values, rows, cols, h = MeanVarOpt.__ineq_triplets(constraints, group_constraints)
+
+        if not h:
+            return [None, None]
+
+        low_constraints, high_constraints = constraints
+        if low_constraints is not None:
+            num_assets = len(low_constraints)
+        elif high_constraints is not None:
+            num_assets = len(high_constraints)
+
+        G = cvxopt.spmatrix(values, rows, cols, (len(h), num_assets))
+
+        return [G, cvxopt.matrix(np.array(h, dtype=np.float64))]
+
+
+    def __build_quad_program(
+            self,
+            ineq_qp_args: t.Union[list, None] = None) -> None:
         # 组建带不等式约束的二次规划所需要的参数(除了预期收益率参数b)
         '''
         Minimize obj = 1/2 * x @ P @ x + q @ x
         subject to G @ x <= h, A @ x = b
+
+        因子模型 V = Bs @ Bs.T + D 下, 引入因子暴露 z = Bs.T @ x 作为辅助变量 x' = [x, z]:
+        1/2 * x @ V @ x = 1/2 * (x @ D @ x + z @ z), P 为对角阵, 等式约束增加 Bs.T @ x - z = 0
         '''
-        ## P: 二次规划-目标函数中的正定矩阵
-        self.__P = self.__expct_cov_mat.astype(np.float64)
+        self.__num_assets = len(self.__expct_rtn_rates)
+        num_aux = self.__num_aux
+
+        ## P: 二次规划-目标函数中的正定矩阵. 因子模型下只保存对角线
+        if num_aux:
+            self.__P = np.concatenate([self.__expct_cov_mat.specific_var, np.ones(num_aux)])
+        else:
+            self.__P = self.__expct_cov_mat.astype(np.float64)
         ## q: 二次规划-目标函数中的一次项系数
-        self.__q = np.zeros_like(self.__expct_rtn_rates).astype(np.float64)
+        self.__q = np.zeros(self.__num_assets + num_aux)
         ## A: 二次规划-等式约束中的系数矩阵.有两个等式约束：1、以未定元为权重的加权预期收益率为goal_r，2、未定元相加之和为1
         ## 第1个约束要等到goal_r加进来之后
         self.__A = np.stack(
                             [self.__expct_rtn_rates, np.ones_like(self.__expct_rtn_rates)],
                              axis=0
                              ).astype(np.float64)
-        ## G: 二次规划-不等式约束中的系数矩阵. 有两个不等式约束：1、下限，2、上限
-        self.__num_assets = len(self.__expct_rtn_rates)
+        if num_aux:
+            self.__A = np.block([
+                [self.__A, np.zeros((2, num_aux))],
+                [self.__expct_cov_mat.scaled_loadings.T, -np.eye(num_aux)]
+                ])
+
+        ## G, h: 二次规划-不等式约束. 只依赖于上下限, 可以由外部预先构建后复用
+        self.__G, self.__h = ineq_qp_args if ineq_qp_args is not None else [None, None]
+
+        self.__qp_args = None
+        # box 后端不需要稠密的 G, h, 等到 cvxopt 求解时再构建
+        if self.__qp_backend == 'cvxopt':
+            self.__build_cvxopt_args()
+
+
+    def __build_cvxopt_args(self) -> None:
+        ## 转换为cvxopt矩阵后缓存, 多次求解(如frontier)时只需要替换b
+        if self.__no_bounds or self.__qp_args is not None:
+            return
+
+        if self.__G is None:
+            self.__G, self.__h = self.build_ineq_qp_args(
+                [self.__low_constraints, self.__high_constraints],
+                self.__group_constraints,
+                self.__num_assets
+                )
 
-        if not self.__no_bounds:
-            self.__G = np.concatenate(
-                                      [-np.eye(self.__num_assets), np.eye(self.__num_assets)],
-                                      axis=0
-                                      ).astype(np.float64)
-            self.__h = np.concatenate(
-                                      [-self.__low_constraints, self.__high_constraints],
-                                      axis=0
-                                      ).astype(np.float64)
-        else: # 上下限都未给时，默认为无不等式约束
-            self.__G = None
-            self.__h = None
+        if self.__num_aux:
+            # 辅助变量不受不等式约束, G 补零列
+            P = cvxopt.spdiag( cvxopt.matrix(self.__P) )
+            G = cvxopt.sparse([[self.__G],
+                               [cvxopt.spmatrix([], [], [], (self.__G.size[0], self.__num_aux))]])
+        else:
+            P, G = cvxopt.matrix(self.__P), self.__G
+
+        self.__qp_args = [P, cvxopt.matrix(self.__q), G, self.__h, cvxopt.matrix(self.__A)]
     
     @property
     def portf_rtn(self) -> np.floating:
-        if self.__portf_rtn != np.float32(0):
+        if self.__portf_rtn != np.float64(0):
             return self.__portf_rtn
         else:
             return self.__expct_rtn_rates @ self.__portf_w
     
     @property
     def portf_var(self) -> np.floating:
-        if self.__portf_var != np.float32(-1):
+        if self.__portf_var != np.float64(-1):
             return self.__portf_var
         else:
             return self.__portf_w @ self.__expct_cov_mat @ self.__portf_w
@@ -157,6 +310,27 @@ class MeanVarOpt:
         else:
             raise NotImplementedError('portf_w not calculated')
 
+    @property
+    def qp_solution(self) -> t.Union[dict, None]:
+        # 最近一次二次规划的 primal/dual 解 {'x', 's', 'y', 'z'}, 可作为 initvals 热启动下一次求解
+        return self.__qp_solution
+
+    @property
+    def critical_line(self) -> CriticalLineOpt:
+        # 上下限约束下有效前沿的全部角点组合, 只计算一次
+        if self.__cla is None:
+            self.__cla = CriticalLineOpt(
+                self.__expct_rtn_rates,
+                self.__expct_cov_mat.to_dense() if self.__num_aux else self.__expct_cov_mat,
+                [self.__low_constraints, self.__high_constraints],
+                self.assets_idlst
+                )
+        return self.__cla
+
+    @property
+    def qp_iterations(self) -> int:
+        return self.__qp_iterations
+
     @property
     def solve_status(self) -> str:
         if self.__solve_status != '':
@@ -167,18 +341,19 @@ class MeanVarOpt:
     @staticmethod
     def __cal_portf_w_unbounds_from_rtn(
         goal_r: np.floating,
-        expct_rtn_rates: np.ndarray,
-        cov_mat_inv: np.ndarray,
+        cov_inv_ones: np.ndarray,
+        cov_inv_rtn: np.ndarray,
         norm_term: np.floating,
         quad_term: np.floating,
         lin_term: np.floating,
         const_term: np.floating) -> np.ndarray:
 
-        ones = np.ones_like(expct_rtn_rates)
-        portf_w =  \
-            goal_r * 1.0 / norm_term * cov_mat_inv @ ( quad_term * expct_rtn_rates - lin_term * ones ) \
-            + \
-            1.0 / norm_term * cov_mat_inv @ ( const_term * ones - lin_term * expct_rtn_rates )
+        # goal_r 可以是标量, 返回 shape (num_assets,); 也可以是 shape (num_targets,) 的数组,
+        # 返回 shape (num_targets, num_assets), 每行是对应 goal_r 的最优权重
+        # cov_inv_ones = V^{-1} @ ones, cov_inv_rtn = V^{-1} @ rtn
+        slope_w = 1.0 / norm_term * ( quad_term * cov_inv_rtn - lin_term * cov_inv_ones )
+        intercept_w = 1.0 / norm_term * ( const_term * cov_inv_ones - lin_term * cov_inv_rtn )
+        portf_w = np.asarray(goal_r)[..., None] * slope_w + intercept_w
         
         assert not np.isnan(portf_w).any(),\
             f'NaN calculation on __cal_portf_w_unbounds_from_rtn'
@@ -196,7 +371,7 @@ class MeanVarOpt:
         portf_var = 1.0 / norm_term * \
             (quad_term * np.power(goal_r, 2) - 2 * lin_term * goal_r + const_term)
         
-        assert not np.isnan(portf_var),\
+        assert not np.isnan(portf_var).any(),\
             f'NaN calculation on __cal_portf_var_unbounds_from_rtn'
         
         return portf_var
@@ -215,7 +390,7 @@ class MeanVarOpt:
                 (goal_var + np.power(lin_term, 2)/(norm_term*quad_term) - const_term/norm_term)
                 )
         
-        assert not np.isnan(porft_rtn),\
+        assert not np.isnan(porft_rtn).any(),\
             f'NaN calculation on __cal_portf_rtn_unbounds_from_var'
         
         return porft_rtn
@@ -233,8 +408,8 @@ class MeanVarOpt:
         
         self.__portf_w = self.__cal_portf_w_unbounds_from_rtn(
             goal_r,
-            self.__expct_rtn_rates,
-            self.__cov_mat_inv,
+            self.__cov_inv_ones,
+            self.__cov_inv_rtn,
             self.__norm_term,
             self.__quad_term,
             self.__lin_term,
@@ -249,7 +424,7 @@ class MeanVarOpt:
             self.__const_term
         )
         
-        self.__portf_rtn = goal_r
+        self.__portf_rtn = np.float64(goal_r)
 
         self.__solve_status = "direct"
 
@@ -274,23 +449,344 @@ class MeanVarOpt:
 
         self.__portf_w = self.__cal_portf_w_unbounds_from_rtn(
             self.__portf_rtn,
-            self.__expct_rtn_rates,
-            self.__cov_mat_inv,
+            self.__cov_inv_ones,
+            self.__cov_inv_rtn,
             self.__norm_term,
             self.__quad_term,
             self.__lin_term,
             self.__const_term
         )
 
-        self.__portf_var = goal_var
+        self.__portf_var = np.float64(goal_var)
 
         self.__solve_status = "direct"
 
 
+    # 不考虑不等式约束，根据给定的无风险收益率rf，直接得到 夏普比率最大的切点portfolio权重
+    def __get_portf_unbounds_sharp(
+            self,
+            risk_free:np.floating) -> None:
+        '''
+        w = V^{-1} @ (rtn - rf) / ones @ V^{-1} @ (rtn - rf)
+          = (cov_inv_rtn - rf * cov_inv_ones) / (a - rf * c)
+        只有 rf < a/c (最小方差点的收益率) 时, 切点位于有效前沿上
+        '''
+        if risk_free >= self.__vertex[1]:
+            raise ValueError(
+                f"maximum risk free rate value(after dilate) for "
+                f"this process is {round(self.__vertex[1],3)}. Lower risk free rate"
+                )
+
+        excess_norm = self.__lin_term - risk_free * self.__quad_term
+
+        self.__portf_w = (self.__cov_inv_rtn - risk_free * self.__cov_inv_ones) / excess_norm
+
+        self.__portf_rtn = (self.__const_term - risk_free * self.__lin_term) / excess_norm
+
+        self.__portf_var = (self.__const_term - 2 * risk_free * self.__lin_term + \
+                            np.power(risk_free, 2) * self.__quad_term) / np.power(excess_norm, 2)
+
+        self.__solve_status = "direct"
+
+
+    # 考虑不等式约束，根据给定的无风险收益率rf，求解夏普比率最大的portfolio权重
+    def __get_portf_bounds_sharp(
+            self,
+            risk_free:np.floating,
+            initvals:t.Union[dict, None] = None) -> None:
+        '''
+        max (rtn @ w - rf) / sqrt(w @ V @ w), s.t. ones @ w = 1, low <= w <= high
+        令 y = kappa * w, kappa >= 0, 齐次化为一个凸二次规划:
+        Minimize 1/2 * y @ V @ y
+        subject to (rtn - rf) @ y = 1, ones @ y - kappa = 0,
+                   G @ y - h * kappa <= 0, -kappa <= 0
+        w = y / kappa. G, h 为上下限与组约束, 齐次化后仍是稀疏的
+        因子模型下同 __build_quad_program, 增加辅助变量 z = Bs.T @ y, 变量为 [y, kappa, z]
+        '''
+        num, num_aux = self.__num_assets, self.__num_aux
+
+        if num_aux:
+            P = cvxopt.spdiag( cvxopt.matrix(
+                np.concatenate([self.__expct_cov_mat.specific_var, [0.0], np.ones(num_aux)])
+                ) )
+        else:
+            P = np.zeros((num+1, num+1))
+            P[:num, :num] = self.__expct_cov_mat
+            P = cvxopt.matrix(P)
+        q = np.zeros(num+1+num_aux)
+
+        values, rows, cols, h = self.__ineq_triplets(
+            [self.__low_constraints, self.__high_constraints],
+            self.__group_constraints
+            )
+        num_rows = len(h)
+        # 最后一列为 -h, 最后一行为 -kappa <= 0
+        G = cvxopt.spmatrix(
+            values + [-i for i in h] + [-1.0],
+            rows + list(range(num_rows)) + [num_rows],
+            cols + [num] * num_rows + [num],
+            (num_rows+1, num+1+num_aux)
+            )
+        A = np.stack([
+            np.append(self.__expct_rtn_rates - risk_free, 0.0),
+            np.append(np.ones(num), -1.0)
+            ], axis=0)
+        if num_aux:
+            A = np.block([
+                [A, np.zeros((2, num_aux))],
+                [self.__expct_cov_mat.scaled_loadings.T, np.zeros((num_aux, 1)), -np.eye(num_aux)]
+                ])
+        qp_args = [P, cvxopt.matrix(q), G,
+                   cvxopt.matrix(np.zeros(num_rows+1)), cvxopt.matrix(A)]
+
+        qp_result = self.__run_qp(qp_args, np.concatenate([[1.0, 0.0], np.zeros(num_aux)]), initvals)
+
+        y = np.array(qp_result['x']).squeeze(1)
+
+        self.__portf_w = y[:num] / y[num]
+
+        self.__portf_var = self.__portf_w @ self.__expct_cov_mat @ self.__portf_w
+
+        self.__portf_rtn = self.__expct_rtn_rates @ self.__portf_w
+
+        self.__solve_status = "qp_" + qp_result['status']
+
+
+    @staticmethod
+    def __interior_initvals(
+        initvals: t.Union[dict, None]
+        ) -> t.Union[dict, None]:
+        # 上一次的最优解处, 部分松弛变量s和对偶变量z贴近0, 直接作为内点法初始值反而更慢甚至数值失败.
+        # 将s, z中小于均值的分量抬到均值, 使初始点远离边界
+        if initvals is None:
+            return None
+
+        initvals = dict(initvals)
+        for k in ('s', 'z'):
+            v = np.array(initvals[k]).squeeze(1)
+            initvals[k] = cvxopt.matrix( np.maximum(v, v.mean()) )
+
+        return initvals
+
+
+    # 考虑不等式约束，用缓存的二次规划参数，只替换预期收益率b求解
+    # initvals: 可选的初始 primal/dual 解 {'x', 's', 'y', 'z'}, 用于热启动
+    def __solve_bounds_qp(
+            self,
+            goal_r:np.floating,
+            initvals:t.Union[dict, None] = None) -> dict:
+
+        self.__b = np.concatenate([[goal_r, 1.0], np.zeros(self.__num_aux)]).astype(np.float64)
+
+        if self.__qp_backend == 'box':
+            return self.__run_box_qp(goal_r, initvals)
+
+        self.__build_cvxopt_args()
+
+        return self.__run_qp(self.__qp_args, self.__b, initvals)
+
+
+    # box 后端求解 minWave 二次规划, initvals 中只用到上一次的权重 'x'
+    def __run_box_qp(
+            self,
+            goal_r:np.floating,
+            initvals:t.Union[dict, None] = None) -> dict:
+
+        w0 = np.array(initvals['x']).reshape(-1)[:self.__num_assets] if initvals is not None else None
+
+        qp_result = solve_box_qp(
+            self.__expct_cov_mat,
+            self.__expct_rtn_rates,
+            goal_r,
+            self.__low_constraints,
+            self.__high_constraints,
+            w0
+            )
+
+        self.__qp_solution = {'x': qp_result['x']}
+        self.__qp_iterations = qp_result['iterations']
+
+        return qp_result
+
+
+    # 考虑不等式约束，直接求解 max rtn @ w, s.t. w @ V @ w <= goal_var, 上下限, ones @ w = 1
+    # initvals: 可选的初始 primal/dual 解 {'x', 'sl', 'sq', 'y', 'zl', 'zq'}, 用于热启动
+    def __solve_bounds_socp(
+            self,
+            goal_var:np.floating,
+            initvals:t.Union[dict, None] = None) -> dict:
+        '''
+        以 V = F @ F.T 的分解因子F, 方差约束写为二阶锥约束 || F.T @ w || <= sqrt(goal_var):
+        Minimize -rtn @ w
+        subject to G @ w <= h (上下限),
+                   hq - Gq @ w in SOC, 其中 Gq = [0; -F.T], hq = [sqrt(goal_var); 0]
+                   ones @ w = 1
+        '''
+        num = self.__num_assets
+
+        c = cvxopt.matrix( -self.__expct_rtn_rates.astype(np.float64) )
+        Gq = [cvxopt.matrix( np.concatenate(
+            [np.zeros((1, num)), -self.__cov_factor.lower_factor.T], axis=0
+            ) )]
+        hq = [cvxopt.matrix( np.concatenate([[np.sqrt(goal_var)], np.zeros(num)]) )]
+        A = cvxopt.matrix( np.ones((1, num)) )
+        b = cvxopt.matrix( np.ones(1) )
+
+        self.__build_cvxopt_args()
+        socp_args = [c, self.__G, self.__h, Gq, hq, A, b]
+
+        primalstart, dualstart = self.__interior_socp_initvals(initvals)
+        try:
+            socp_result = cvxopt.solvers.socp(*socp_args,
+                                              primalstart=primalstart, dualstart=dualstart)
+        except ValueError:
+            if initvals is None:
+                raise
+            # 热启动点数值上不可用时, 退回冷启动
+            socp_result = cvxopt.solvers.socp(*socp_args)
+
+        self.__qp_solution = {k: socp_result[k] for k in ('x', 'sl', 'sq', 'y', 'zl', 'zq')}
+        self.__qp_iterations = socp_result['iterations']
+
+        return socp_result
+
+
+    # 因子模型下, 有约束的 maxReturn 不用二阶锥规划(cvxopt 中高维二阶锥的缩放矩阵是稠密的, 失去因子结构),
+    # 而是对目标收益率 r 求根: 有效前沿上的最小方差 var(r) 在 [最小方差组合的 r, 最大收益 r] 上单调递增,
+    # 用 Illinois 弦截法找 var(r) = goal_var. 每一步是一次辅助变量二次规划, 以上一步的解热启动
+    def __solve_bounds_qp_from_var(
+            self,
+            goal_var:np.floating,
+            initvals:t.Union[dict, None] = None,
+            rtol:float = 1e-6,
+            max_iter:int = 50) -> dict:
+
+        num, num_aux = self.__num_assets, self.__num_aux
+        self.__build_cvxopt_args()
+        P, q, G, h, A = self.__qp_args
+
+        # 最大收益组合: 线性规划 min -rtn @ x, s.t. G @ x <= h, ones @ x = 1
+        lp_result = cvxopt.solvers.lp(
+            cvxopt.matrix(-self.__expct_rtn_rates.astype(np.float64)),
+            self.__G, self.__h,
+            cvxopt.matrix(np.ones((1, num))), cvxopt.matrix(np.ones(1))
+            )
+        if lp_result['status'] != 'optimal':
+            return {'x': np.full(num, np.nan), 'status': lp_result['status'],
+                    'iterations': lp_result['iterations']}
+
+        w_max = np.array(lp_result['x']).reshape(-1)
+        var_max = w_max @ self.__expct_cov_mat @ w_max
+        iterations = lp_result['iterations']
+        # 最大收益组合的波动不超过 goal_var 时, 方差约束不起作用
+        if var_max <= goal_var:
+            self.__qp_solution, self.__qp_iterations = None, iterations
+            return {'x': w_max, 'status': 'optimal', 'iterations': iterations}
+
+        # 最小方差组合: 去掉收益率等式约束
+        mv_result = self.__run_qp([P, q, G, h, A[1:, :]], np.concatenate([[1.0], np.zeros(num_aux)]))
+        w_mv = np.array(mv_result['x']).reshape(-1)[:num]
+        var_mv = 2.0 * mv_result['primal objective']
+        iterations += mv_result['iterations']
+        if var_mv > goal_var * (1 + rtol):
+            raise ValueError(
+                f"minimum expected target variance value(after dilate) for "
+                f"this process is {round(var_mv,3)}. Raise goal variance"
+                )
+
+        lo_r, lo_f = self.__expct_rtn_rates @ w_mv, var_mv - goal_var
+        hi_r, hi_f = self.__expct_rtn_rates @ w_max, var_max - goal_var
+        qp_result, side = mv_result, 0
+        status = 'unknown'
+
+        for _ in range(max_iter):
+            goal_r = hi_r - hi_f * (hi_r - lo_r) / (hi_f - lo_f)
+            qp_result = self.__run_qp(self.__qp_args, np.concatenate([[goal_r, 1.0], np.zeros(num_aux)]),
+                                      initvals)
+            iterations += qp_result['iterations']
+            if qp_result['status'] != 'optimal':
+                status = qp_result['status']
+                break
+            initvals = self.__qp_solution
+
+            f = 2.0 * qp_result['primal objective'] - goal_var
+            if abs(f) <= rtol * goal_var:
+                status = 'optimal'
+                break
+
+            # Illinois: 同一端连续保留时, 将其函数值减半, 避免弦截法单侧收敛过慢
+            if f > 0:
+                hi_r, hi_f = goal_r, f
+                if side == 1:
+                    lo_f /= 2
+                side = 1
+            else:
+                lo_r, lo_f = goal_r, f
+                if side == -1:
+                    hi_f /= 2
+                side = -1
+
+        self.__qp_iterations = iterations
+
+        return {'x': np.array(qp_result['x']).reshape(-1)[:num], 'status': status,
+                'iterations': iterations}
+
+
+    @staticmethod
+    def __interior_socp_initvals(
+        initvals: t.Union[dict, None]
+        ) -> t.Tuple[t.Union[dict, None], t.Union[dict, None]]:
+        # 与 __interior_initvals 相同, 将线性锥的 s, z 抬离边界;
+        # 二阶锥 (t, v) 要求 t > ||v||, 将 t 抬到 2 * ||v||
+        if initvals is None or initvals['x'] is None:
+            return None, None
+
+        def lift_l(m):
+            v = np.array(m).squeeze(1)
+            return cvxopt.matrix( np.maximum(v, v.mean()) )
+
+        def lift_q(m):
+            v = np.array(m).squeeze(1).copy()
+            v[0] = max(v[0], 2.0 * np.linalg.norm(v[1:]), 1e-8)
+            return cvxopt.matrix(v)
+
+        primalstart = {'x': initvals['x'],
+                       'sl': lift_l(initvals['sl']),
+                       'sq': [lift_q(m) for m in initvals['sq']]}
+        dualstart = {'y': initvals['y'],
+                     'zl': lift_l(initvals['zl']),
+                     'zq': [lift_q(m) for m in initvals['zq']]}
+
+        return primalstart, dualstart
+
+
+    # 求解二次规划 [P, q, G, h, A] 与 b, 记录 primal/dual 解与迭代次数
+    def __run_qp(
+            self,
+            qp_args:list,
+            b:np.ndarray,
+            initvals:t.Union[dict, None] = None) -> dict:
+
+        try:
+            qp_result = cvxopt.solvers.qp(*qp_args, cvxopt.matrix(b),
+                                          initvals=self.__interior_initvals(initvals))
+        except ValueError:
+            if initvals is None:
+                raise
+            # 热启动点数值上不可用时, 退回冷启动
+            qp_result = cvxopt.solvers.qp(*qp_args, cvxopt.matrix(b))
+
+        self.__qp_solution = {k: qp_result[k] for k in ('x', 's', 'y', 'z')}
+        self.__qp_iterations = qp_result['iterations']
+
+        return qp_result
+
+
     # 考虑不等式约束，根据给定的预期收益率r(即满足至少要r的预期收益率)，求解portfolio波动最小的protf权重，以及此时的var
     def __get_portf_bounds_from_rtn(
             self,
-            goal_r:np.floating) -> None:
+            goal_r:np.floating,
+            initvals:t.Union[dict, None] = None) -> None:
         
         if goal_r < self.__vertex[1]:
             raise ValueError(
@@ -298,24 +794,26 @@ class MeanVarOpt:
                 f"this process is {round(self.__vertex[1],3)}. Raise goal return"
                 )
         
-        self.__b = np.array([goal_r, 1.0]).astype(np.float64)
-        qp_args = [self.__P, self.__q, self.__G, self.__h, self.__A, self.__b]
-        qp_args = [cvxopt.matrix(i) if i is not None else None for i in qp_args]
-        qp_result = cvxopt.solvers.qp(*qp_args)
+        if self.__qp_backend == 'cla':
+            self.__set_cla_res( self.critical_line(goal_r, 'minWave') )
+            return
+
+        qp_result = self.__solve_bounds_qp(goal_r, initvals)
 
-        self.__portf_w = np.array(qp_result['x']).squeeze(1)
+        self.__portf_w = np.array(qp_result['x']).reshape(-1)[:self.__num_assets]
 
-        self.__portf_var = np.float32( 2.0 * qp_result['primal objective'] )
+        self.__portf_var = np.float64( 2.0 * qp_result['primal objective'] )
 
         self.__portf_rtn = self.__expct_rtn_rates @ self.__portf_w
 
-        self.__solve_status = "qp_" + qp_result['status']
+        self.__solve_status = self.__qp_prefix + qp_result['status']
 
 
     # 考虑不等式约束，根据给定的预期波动var(即能承受的最低波动var)，求解portfolio预期收益最大的protf权重，以及此时的r
     def __get_portf_bounds_from_var(
             self,
-            goal_var:np.floating) -> None:
+            goal_var:np.floating,
+            initvals:t.Union[dict, None] = None) -> None:
         
         if goal_var < self.__vertex[0]:
             raise ValueError(
@@ -323,32 +821,103 @@ class MeanVarOpt:
                 f"this process is {round(self.__vertex[0],3)}. Raise goal variance"
                 )
         
-        goal_r = self.__cal_portf_rtn_unbounds_from_var(
-            goal_var,
-            self.__norm_term,
-            self.__quad_term,
-            self.__lin_term,
-            self.__const_term
-            )
+        if self.__qp_backend == 'cla':
+            self.__set_cla_res( self.critical_line(goal_var, 'maxReturn') )
+            return
 
-        self.__b = np.array([goal_r, 1.0]).astype(np.float64)
-        qp_args = [self.__P, self.__q, self.__G, self.__h, self.__A, self.__b]
-        qp_args = [cvxopt.matrix(i) if i is not None else None for i in qp_args]
-        qp_result = cvxopt.solvers.qp(*qp_args)
+        if self.__num_aux:
+            qp_result = self.__solve_bounds_qp_from_var(goal_var, initvals)
+            self.__portf_w = qp_result['x']
+            self.__portf_var = self.__portf_w @ self.__expct_cov_mat @ self.__portf_w
+            self.__portf_rtn = self.__expct_rtn_rates @ self.__portf_w
+            self.__solve_status = "qp_" + qp_result['status']
+            return
 
-        self.__portf_w = np.array(qp_result['x']).squeeze(1)
+        socp_result = self.__solve_bounds_socp(goal_var, initvals)
 
-        self.__portf_var = np.float32( 2.0 * qp_result['primal objective'] )
+        # 约束下不存在方差不超过 goal_var 的组合时, cvxopt 不返回解
+        self.__portf_w = np.full(self.__num_assets, np.nan) if socp_result['x'] is None else \
+            np.array(socp_result['x']).reshape(-1)
+
+        self.__portf_var = self.__portf_w @ self.__expct_cov_mat @ self.__portf_w
 
         self.__portf_rtn = self.__expct_rtn_rates @ self.__portf_w
 
-        self.__solve_status = "qp_" + qp_result['status']
+        self.__solve_status = "socp_" + socp_result['status']
+
+
+    def __is_feasible(
+            self,
+            portf_w:np.ndarray) -> np.ndarray:
+        # portf_w 的最后一维是资产, 逐个portfolio检查上下限与组约束, 返回 bool (数组)
+        feasible = np.ones(portf_w.shape[:-1], dtype=bool)
+
+        if self.__low_constraints is not None:
+            feasible &= (portf_w >= self.__low_constraints).all(axis=-1)
+        if self.__high_constraints is not None:
+            feasible &= (portf_w <= self.__high_constraints).all(axis=-1)
+
+        if self.__group_constraints is not None:
+            for members, low, high in zip(*self.__group_constraints):
+                group_w = portf_w[..., members].sum(axis=-1)
+                # nan 的一侧无约束, 比较结果取反后为 False
+                feasible &= ~(group_w < low) & ~(group_w > high)
+
+        return feasible
+
+
+    # 有约束时, 先计算无约束的闭式解. 闭式解已满足约束时, 它也是有约束问题的最优解, 不必求解二次规划
+    def __get_portf_unbounds_if_feasible(
+            self,
+            tgt_value:np.floating,
+            mode:str) -> bool:
+
+        try:
+            if mode == 'minWave':
+                self.__get_portf_unbounds_from_rtn(tgt_value)
+            elif mode == 'maxReturn':
+                self.__get_portf_unbounds_from_var(tgt_value)
+            else:
+                self.__get_portf_unbounds_sharp(tgt_value)
+        except ValueError:
+            # 目标值超出无约束曲线的范围, 交给有约束的求解给出结果或报错
+            return False
+
+        if not self.__is_feasible(self.__portf_w):
+            return False
+
+        self.__solve_status = "direct_feasible"
+        self.__qp_solution, self.__qp_iterations = None, 0
+
+        return True
+
+
+    # 记录临界线算法的查询结果, 不涉及二次规划
+    def __set_cla_res(
+            self,
+            cla_res:basicPortfSolveRes) -> None:
+
+        self.__portf_w = cla_res['portf_w']
+        self.__portf_var = cla_res['portf_var']
+        self.__portf_rtn = cla_res['portf_rtn']
+        self.__solve_status = cla_res['solve_status']
+        self.__qp_solution, self.__qp_iterations = None, 0
 
 
     def __call__(
             self,
             tgt_value: np.floating,
-            mode: str) -> basicPortfSolveRes:
+            mode: str,
+            initvals: t.Union[dict, None] = None) -> basicPortfSolveRes:
+        '''
+        mode:
+            minWave: tgt_value 为预期收益率r, 求波动最小的portfolio
+            maxReturn: tgt_value 为能承受的波动var, 求预期收益最大的portfolio
+            sharp: tgt_value 为无风险收益率rf, 求夏普比率最大的portfolio
+        initvals: 可选, 有上下限约束时作为二次规划的初始 primal/dual 解(热启动),
+            一般是上一个滚动窗口的 qp_solution
+        有约束时, 若无约束的闭式解已满足约束, 直接采用, solve_status 为 'direct_feasible'
+        '''
         
         # 计算模式
         if mode not in ['minWave', 'maxReturn', 'sharp']:
@@ -359,24 +928,271 @@ class MeanVarOpt:
         # 按模式求解
         if mode == 'minWave' and self.__no_bounds:
             self.__get_portf_unbounds_from_rtn(tgt_value)
+        elif not self.__no_bounds and self.__get_portf_unbounds_if_feasible(tgt_value, mode):
+            # 只在有约束时尝试: 无约束的 maxReturn / sharp 由下面的闭式解分支求解, 状态为 'direct'
+            pass
         elif mode == 'minWave':
-            self.__get_portf_bounds_from_rtn(tgt_value)
+            self.__get_portf_bounds_from_rtn(tgt_value, initvals)
         elif mode == 'maxReturn' and self.__no_bounds:
             self.__get_portf_unbounds_from_var(tgt_value)
         elif mode == 'maxReturn':
-            self.__get_portf_bounds_from_var(tgt_value)
+            self.__get_portf_bounds_from_var(tgt_value, initvals)
+        elif self.__no_bounds:
+            self.__get_portf_unbounds_sharp(tgt_value)
         else:
-            raise NotImplementedError('mode sharp note implemented')
+            self.__get_portf_bounds_sharp(tgt_value, initvals)
         
         return {
             'portf_w': self.portf_w,
             'portf_rtn': self.portf_rtn,
             'portf_var': self.portf_var,
             'solve_status': self.solve_status,
+            'assets_idlst': self.assets_idlst,
+            'qp_iterations': self.qp_iterations
+            }
+
+
+    def frontier(
+            self,
+            tgt_values: np.ndarray,
+            mode: str) -> frontierPortfSolveRes:
+        '''
+        一次性求解多个目标值, 得到有效前沿上的一组portfolio
+        无上下限约束时, 用闭式解向量化计算;
+        有上下限约束时, 闭式解已满足约束的目标值直接采用('direct_feasible'), 其余目标值:
+        minWave 复用同一组二次规划参数, 只替换预期收益率b逐个求解
+        (box 后端以前一个目标值的解热启动);
+        maxReturn 对每个var逐个求解二阶锥规划;
+        cla 后端对其余目标值直接在角点组合上批量查询
+        return:
+        frontierPortfSolveRes
+        {
+            'portf_w': np.ndarray, shape (num_targets, num_assets)
+            'portf_rtn': np.ndarray, shape (num_targets, )
+            'portf_var': np.ndarray, shape (num_targets, )
+            'solve_status': list of str
+            'assets_idlst': list
+        }
+        '''
+        # 计算模式
+        if mode not in ['minWave', 'maxReturn']:
+            raise ValueError(
+                f'wrong mode for mean-variance frontier with {mode}'
+                )
+
+        tgt_values = np.asarray(tgt_values, dtype=np.float64).reshape(-1)
+
+        if mode == 'minWave' and (tgt_values < self.__vertex[1]).any():
+            raise ValueError(
+                f"minimum expected target return value(after dilate) for "
+                f"this process is {round(self.__vertex[1],3)}. Raise goal return"
+                )
+        elif mode == 'maxReturn' and (tgt_values < self.__vertex[0]).any():
+            raise ValueError(
+                f"minimum expected target variance value(after dilate) for "
+                f"this process is {round(self.__vertex[0],3)}. Raise goal variance"
+                )
+
+        # 先向量化计算无约束的闭式解. maxReturn 模式下, 由曲线将 var 转换为 r
+        if mode == 'maxReturn':
+            goal_rs = self.__cal_portf_rtn_unbounds_from_var(
+                tgt_values,
+                self.__norm_term,
+                self.__quad_term,
+                self.__lin_term,
+                self.__const_term
+                )
+        else:
+            goal_rs = tgt_values
+
+        portf_w = self.__cal_portf_w_unbounds_from_rtn(
+            goal_rs,
+            self.__cov_inv_ones,
+            self.__cov_inv_rtn,
+            self.__norm_term,
+            self.__quad_term,
+            self.__lin_term,
+            self.__const_term
+            )
+        portf_rtn = goal_rs
+        portf_var = tgt_values.copy() if mode == 'maxReturn' else \
+            self.__cal_portf_var_unbounds_from_rtn(
+                goal_rs,
+                self.__norm_term,
+                self.__quad_term,
+                self.__lin_term,
+                self.__const_term
+                )
+
+        if self.__no_bounds:
+            solve_status = ["direct"] * len(tgt_values)
+            return {
+                'portf_w': portf_w,
+                'portf_rtn': portf_rtn,
+                'portf_var': portf_var,
+                'solve_status': solve_status,
+                'assets_idlst': self.assets_idlst
+                }
+
+        # 有约束时, 闭式解已满足约束的目标值不必求解, 只对其余目标值逐个求解
+        feasible = self.__is_feasible(portf_w)
+        solve_status = np.where(feasible, "direct_feasible", "").astype(object)
+
+        if self.__qp_backend == 'cla':
+            if not feasible.all():
+                cla_res = self.critical_line.frontier(tgt_values[~feasible], mode)
+                portf_w[~feasible], portf_var[~feasible] = cla_res['portf_w'], cla_res['portf_var']
+                solve_status[~feasible] = cla_res['solve_status']
+        elif mode == 'minWave':
+            initvals = None
+            for k in np.where(~feasible)[0]:
+                qp_result = self.__solve_bounds_qp(tgt_values[k], initvals)
+                if self.__qp_backend == 'box' and qp_result['status'] == 'optimal':
+                    initvals = self.__qp_solution
+                portf_w[k] = np.array(qp_result['x']).reshape(-1)[:self.__num_assets]
+                portf_var[k] = 2.0 * qp_result['primal objective']
+                solve_status[k] = self.__qp_prefix + qp_result['status']
+        else:
+            for k in np.where(~feasible)[0]:
+                if self.__num_aux:
+                    qp_result = self.__solve_bounds_qp_from_var(tgt_values[k])
+                    portf_w[k], solve_status[k] = qp_result['x'], "qp_" + qp_result['status']
+                else:
+                    socp_result = self.__solve_bounds_socp(tgt_values[k])
+                    portf_w[k] = np.array(socp_result['x']).reshape(-1)
+                    solve_status[k] = "socp_" + socp_result['status']
+                portf_var[k] = portf_w[k] @ self.__expct_cov_mat @ portf_w[k]
+
+        portf_rtn = portf_w @ self.__expct_rtn_rates
+        solve_status = solve_status.tolist()
+
+        return {
+            'portf_w': portf_w,
+            'portf_rtn': portf_rtn,
+            'portf_var': portf_var,
+            'solve_status': solve_status,
             'assets_idlst': self.assets_idlst
             }
 
 
+    @staticmethod
+    def solve_unbounds_batch(
+        train_rtn_stack: np.ndarray,
+        tgt_value: np.floating,
+        mode: str,
+        assets_idlst: list,
+        expct_rtn_stack: t.Union[np.ndarray, None] = None,
+        expct_cov_stack: t.Union[np.ndarray, None] = None
+        ) -> t.List[basicPortfSolveRes]:
+        '''
+        无上下限约束时, 闭式解只是线性代数运算. 一次性批量求解一组滚动窗口
+        input:
+            train_rtn_stack: shape (num_windows, num_assets, window_size)
+            expct_rtn_stack: shape (num_windows, num_assets), 各窗口的预期收益率(例如 BL 后验), 不输入时用样本均值
+            expct_cov_stack: shape (num_windows, num_assets, num_assets), 各窗口的协方差(例如收缩估计), 不输入时用样本协方差
+        return:
+            list of basicPortfSolveRes, 每个窗口一条, 与逐窗口 MeanVarOpt(...)(tgt_value, mode) 结果相同.
+            无法求解的窗口(共线 / 目标值低于顶点), solve_status 为 'FAIL_' 开头, portf_w 为空
+        '''
+        if mode not in ['minWave', 'maxReturn', 'sharp']:
+            raise ValueError(
+                f'wrong mode for batched unbounded mean-variance optimal with {mode}'
+                )
+
+        # 取数得到的是 float32, 与 np.cov 一样先转为 float64, 否则奇异判断与闭式解精度都不可靠
+        train_rtn_stack = np.asarray(train_rtn_stack, dtype=np.float64)
+        num_windows, num_assets, window_size = train_rtn_stack.shape
+
+        # 批量计算各窗口的预期收益率 (num_windows, num_assets) 与协方差 (num_windows, num_assets, num_assets)
+        rtn_rates = train_rtn_stack.mean(axis=2)
+        if expct_cov_stack is None:
+            demeaned = train_rtn_stack - rtn_rates[:, :, None]
+            cov_stack = demeaned @ demeaned.transpose(0, 2, 1) / (window_size - 1)
+        else:
+            cov_stack = np.asarray(expct_cov_stack, dtype=np.float64)
+        if expct_rtn_stack is not None:
+            rtn_rates = np.asarray(expct_rtn_stack, dtype=np.float64)
+
+        # 批量求解 V^{-1} @ [ones, rtn]
+        ones = np.ones_like(rtn_rates)
+        solution, singular_mask = batch_cov_solve(
+            cov_stack,
+            np.stack([ones, rtn_rates], axis=2)
+            )
+        cov_inv_ones, cov_inv_rtn = solution[:, :, 0], solution[:, :, 1]
+
+        quad_term = cov_inv_ones.sum(axis=1)
+        lin_term = cov_inv_rtn.sum(axis=1)
+        const_term = np.einsum('wn,wn->w', rtn_rates, cov_inv_rtn)
+        norm_term = const_term * quad_term - np.power(lin_term, 2)
+
+        # var最小的return-var点是(var=1/c, r=a/c)
+        vertex_var, vertex_rtn = 1.0 / quad_term, lin_term / quad_term
+
+        with np.errstate(invalid='ignore'):
+            if mode == 'minWave':
+                below_vertex = tgt_value < vertex_rtn
+                goal_r = np.full(num_windows, tgt_value, dtype=np.float64)
+                portf_var = 1.0 / norm_term * \
+                    (quad_term * np.power(goal_r, 2) - 2 * lin_term * goal_r + const_term)
+            elif mode == 'sharp':
+                # tgt_value 为无风险收益率, 须低于最小方差点的收益率
+                below_vertex = tgt_value >= vertex_rtn
+                excess_norm = lin_term - tgt_value * quad_term
+                goal_r = (const_term - tgt_value * lin_term) / excess_norm
+                portf_var = (const_term - 2 * tgt_value * lin_term + \
+                             np.power(tgt_value, 2) * quad_term) / np.power(excess_norm, 2)
+            else:
+                below_vertex = tgt_value < vertex_var
+                portf_var = np.full(num_windows, tgt_value, dtype=np.float64)
+                goal_r = lin_term/quad_term + \
+                    np.sqrt(
+                        norm_term/quad_term *\
+                        (portf_var + np.power(lin_term, 2)/(norm_term*quad_term) - const_term/norm_term)
+                        )
+
+            slope_w = ( quad_term[:, None] * cov_inv_rtn - lin_term[:, None] * cov_inv_ones ) / norm_term[:, None]
+            intercept_w = ( const_term[:, None] * cov_inv_ones - lin_term[:, None] * cov_inv_rtn ) / norm_term[:, None]
+            portf_w = goal_r[:, None] * slope_w + intercept_w
+
+        res_list = []
+        for i in range(num_windows):
+            if singular_mask[i]:
+                fail_msg = 'Co-Linearity found in covariance matrix'
+            elif below_vertex[i] and mode == 'sharp':
+                fail_msg = f"maximum risk free rate value(after dilate) for " \
+                           f"this process is {round(vertex_rtn[i],3)}. Lower risk free rate"
+            elif below_vertex[i] and mode == 'minWave':
+                fail_msg = f"minimum expected target return value(after dilate) for " \
+                           f"this process is {round(vertex_rtn[i],3)}. Raise goal return"
+            elif below_vertex[i]:
+                fail_msg = f"minimum expected target variance value(after dilate) for " \
+                           f"this process is {round(vertex_var[i],3)}. Raise goal variance"
+            else:
+                fail_msg = ''
+
+            if fail_msg:
+                res_list.append({
+                    'portf_w': np.array([]),
+                    'portf_rtn': np.float64(0),
+                    'portf_var': np.float64(-1),
+                    'solve_status': 'FAIL_' + fail_msg,
+                    'assets_idlst': assets_idlst,
+                    'qp_iterations': 0
+                    })
+            else:
+                res_list.append({
+                    'portf_w': portf_w[i],
+                    'portf_rtn': goal_r[i],
+                    'portf_var': portf_var[i],
+                    'solve_status': 'direct',
+                    'assets_idlst': assets_idlst,
+                    'qp_iterations': 0
+                    })
+
+        return res_list
+
+
 
 
 
@@ -12,6 +12,9 @@
 """
 import scipy.optimize as scipyopt
 import numpy as np
+import typing as t
+from Code.Utils.Type import riskParitySolveRes
+from Code.Utils.LinAlg import factorCovariance
 
 def total_weight_constraint(x):
     return np.sum(x) - 1.0
@@ -19,17 +22,213 @@ def total_weight_constraint(x):
 def loan_only_constraint(x):
     return x
 
+def total_weight_constraint_jac(x):
+    return np.ones_like(x)
+
+def loan_only_constraint_jac(x):
+    return np.eye(len(x))
+
+
+def risk_budget_newton(V:np.array, budgets:np.array, w0:np.array=None, tol:float=1e-10, max_iter:int=100):
+    '''
+    风险预算的 log-barrier 形式:
+        min 1/2 * x @ V @ x - budgets @ log(x),  x > 0
+    一阶条件 x * (V @ x) = budgets, 所以 w = x / sum(x) 的风险贡献比例恰为 budgets.
+    目标函数严格凸, 用解析 Hessian V + diag(budgets / x^2) 做阻尼 newton, 二次收敛,
+    每步一次 n x n 线性方程求解, 不需要数值梯度.
+
+    budgets: 各资产风险预算, 须全部 > 0, 内部归一化
+    w0: 可选初始权重(例如上一个滚动窗口的解)
+
+    return:
+    {
+        'x': np.ndarray, 和为 1 的资产权重
+        'status': 'optimal' | 'unknown'
+        'iterations': int
+    }
+    '''
+    if isinstance(V, factorCovariance):
+        return risk_budget_newton_factor(V, budgets, w0, tol, max_iter)
+    res = risk_budget_newton_batch(V[None], budgets, None if w0 is None else np.asarray(w0)[None], tol, max_iter)
+    return {'x': res['x'][0], 'status': res['status'][0], 'iterations': res['iterations'][0]}
+
+
+def risk_budget_newton_factor(V:factorCovariance, budgets:np.array, w0:np.array=None, tol:float=1e-10,
+                              max_iter:int=100):
+    '''
+    因子模型协方差 V = Bs @ Bs.T + diag(d) 下的 risk_budget_newton, 不构造 n x n 矩阵:
+    Hessian V + diag(budgets / x^2) = Bs @ Bs.T + diag(d + budgets / x^2) 仍是因子结构,
+    newton 方程用 Woodbury 公式求解, 每步 O(nk^2). 返回同 risk_budget_newton
+    '''
+    budgets = budgets / budgets.sum()
+    assert all(budgets > 0), "risk budgets must be positive for the log-barrier solver"
+
+    x = budgets.copy() if w0 is None else np.maximum(np.asarray(w0, dtype=np.float64), 1e-8)
+    x = x / np.sqrt(x @ V @ x)
+
+    obj = lambda x: 0.5 * (x @ V @ x) - np.log(x) @ budgets
+    factor_eye = np.eye(V.scaled_loadings.shape[1])
+
+    status, iterations = 'unknown', max_iter
+    for i in range(max_iter):
+        Vx = V @ x
+        grad = Vx - budgets / x
+        hessian = factorCovariance(V.scaled_loadings, factor_eye, V.specific_var + budgets / np.square(x))
+        step = -hessian.solve(grad)
+        slope = grad @ step
+
+        # 收敛判据同 risk_budget_newton_batch
+        if np.max(np.abs(x * Vx - budgets)) <= tol or -slope <= tol**2:
+            status, iterations = 'optimal', i
+            break
+
+        with np.errstate(divide='ignore'):
+            to_bound = np.where(step < 0, -x / step, np.inf)
+        t = min(1.0, 0.99 * np.min(to_bound))
+        if -slope > 0.25:
+            f0 = obj(x)
+            while obj(x + t * step) > f0 + 1e-4 * t * slope and t > 1e-12:
+                t *= 0.5
+        x = x + t * step
+
+    return {'x': x / x.sum(), 'status': status, 'iterations': iterations}
+
+
+def risk_budget_newton_batch(cov_stack:np.array, budgets:np.array, w0_stack:np.array=None, tol:float=1e-10,
+                             max_iter:int=100):
+    '''
+    risk_budget_newton 的批量版本: 一组协方差 cov_stack (num_windows, n, n) 共用同一个风险预算,
+    所有窗口一起做向量化的 newton 迭代(批量线性方程求解), 已收敛的窗口退出迭代.
+
+    w0_stack: 可选初始权重 (num_windows, n)
+
+    return:
+    {
+        'x': np.ndarray, (num_windows, n) 各窗口和为 1 的资产权重
+        'status': list of 'optimal' | 'unknown'
+        'iterations': np.ndarray, (num_windows, )
+    }
+    '''
+    num_windows, num = cov_stack.shape[0], cov_stack.shape[1]
+    budgets = budgets / budgets.sum()
+    assert all(budgets > 0), "risk budgets must be positive for the log-barrier solver"
+
+    # 初始点缩放到 x @ V @ x = 1 (最优解满足 x @ V @ x = sum(budgets) = 1)
+    x = np.tile(budgets, (num_windows, 1)) if w0_stack is None else \
+        np.maximum(np.asarray(w0_stack, dtype=np.float64), 1e-8)
+    x = x / np.sqrt(np.einsum('wi,wij,wj->w', x, cov_stack, x))[:, None]
+
+    obj = lambda V, x: 0.5 * np.einsum('wi,wij,wj->w', x, V, x) - np.log(x) @ budgets
+
+    status, iterations = ['unknown'] * num_windows, np.full(num_windows, max_iter)
+    diag_idx = np.arange(num)
+    active = np.arange(num_windows) # 尚未收敛的窗口
+    for i in range(max_iter):
+        V, x_a = cov_stack[active], x[active]
+        Vx = np.einsum('wij,wj->wi', V, x_a)
+
+        grad = Vx - budgets / x_a
+        hessian = V.copy()
+        hessian[:, diag_idx, diag_idx] += budgets / np.square(x_a)
+        step = np.linalg.solve(hessian, -grad[:, :, None])[:, :, 0]
+        slope = np.sum(grad * step, axis=1)
+
+        # 风险贡献残差达到 tol, 或 newton decrement 已到机器精度(残差由舍入误差主导)
+        done = (np.max(np.abs(x_a * Vx - budgets), axis=1) <= tol) | (-slope <= tol**2)
+        for w in active[done]:
+            status[w], iterations[w] = 'optimal', i
+        keep = ~done
+        active, V, x_a, step, slope = active[keep], V[keep], x_a[keep], step[keep], slope[keep]
+        if len(active) == 0:
+            break
+
+        # 步长不越过 x > 0 的边界; 远离最优解时回溯保证目标下降,
+        # 进入二次收敛区后目标值的差已低于舍入误差, 直接走完整 newton 步
+        with np.errstate(divide='ignore'):
+            to_bound = np.where(step < 0, -x_a / step, np.inf)
+        t = np.minimum(1.0, 0.99 * np.min(to_bound, axis=1))
+        damped = -slope > 0.25
+        if any(damped):
+            f0 = obj(V[damped], x_a[damped])
+            t_d, s_d = t[damped], step[damped]
+            backtrack = np.ones(len(t_d), dtype=bool)
+            while any(backtrack):
+                f_new = obj(V[damped], x_a[damped] + t_d[:, None] * s_d)
+                backtrack = (f_new > f0 + 1e-4 * t_d * slope[damped]) & (t_d > 1e-12)
+                t_d = np.where(backtrack, 0.5 * t_d, t_d)
+            t[damped] = t_d
+        x[active] = x_a + t[:, None] * step
+
+    return {'x': x / x.sum(axis=1, keepdims=True), 'status': status, 'iterations': iterations}
+
+
+def risk_budget_newton_rolling(cov_stack:np.array, budgets:np.array, num_chains:int=None, tol:float=1e-10,
+                               max_iter:int=100):
+    '''
+    滚动窗口的 risk_budget_newton_batch, 每个窗口以上一窗口的解为初始点, 同时保留批量迭代:
+    窗口按顺序切成 num_chains 段连续的链, 第 r 轮把每条链的第 r 个窗口放在一起批量求解,
+    初始点为同一条链上一轮(即上一窗口)的解. 只有各链的首个窗口从 budgets 冷启动.
+    num_chains = 1 即完全逐窗口接力, num_chains = num_windows 即全部冷启动的一次批量求解;
+    不输入时取 ceil(sqrt(num_windows)), 轮数与每轮的批量大小相当.
+    上一窗口未收敛时, 该链的下一窗口从 budgets 冷启动.
+
+    return: 同 risk_budget_newton_batch
+    '''
+    num_windows, num = cov_stack.shape[0], cov_stack.shape[1]
+    if num_chains is None:
+        num_chains = int(np.ceil(np.sqrt(num_windows)))
+    num_chains = min(max(num_chains, 1), num_windows)
+    chain_len = int(np.ceil(num_windows / num_chains))
+    heads = np.arange(0, num_windows, chain_len)
+
+    x = np.empty((num_windows, num))
+    status, iterations = [''] * num_windows, np.zeros(num_windows, dtype=int)
+    cold = budgets / budgets.sum()
+    for r in range(chain_len):
+        idx = heads + r
+        idx = idx[idx < num_windows] # 最后一条链可能较短
+        if r == 0:
+            w0_stack = None
+        else:
+            prev_ok = np.array([status[w] == 'optimal' for w in idx - 1])
+            w0_stack = np.where(prev_ok[:, None], x[idx - 1], cold)
+
+        res = risk_budget_newton_batch(cov_stack[idx], budgets, w0_stack, tol, max_iter)
+        x[idx], iterations[idx] = res['x'], res['iterations']
+        for w, cur_status in zip(idx, res['status']):
+            status[w] = cur_status
+
+    return {'x': x, 'status': status, 'iterations': iterations}
+
 
 class RiskParity:
-    def __init__(self, asset_r_mat:np.array, category_mat:np.array=None, tgt_contrib_ratio:np.array=None,
-                 assets_idlst:list=[]):
+    def __init__(self, asset_r_mat:np.array=None, category_mat:np.array=None, tgt_contrib_ratio:np.array=None,
+                 assets_idlst:list=[], cov_mat=None, expct_rtn_rates:np.array=None,
+                 cov_estimator:t.Callable=np.cov):
+        # asset_r_mat: 资产收益率 (num_assets, num_days). 也可以不输入, 直接给出 cov_mat 与 expct_rtn_rates:
+        # cov_mat: 预先算好的协方差, np.ndarray 或因子模型协方差 factorCovariance, 其他带 to_dense() 的
+        #     协方差对象转为稠密矩阵. 滚动协方差引擎/收缩估计/统计因子估计的结果可以直接传入, 并与 MeanVarOpt
+        #     共用同一个协方差. factorCovariance 不做稠密化: newton 用 Woodbury 求解, SLSQP 只用到 V @ w
+        # cov_estimator: 未输入 cov_mat 时, 由 asset_r_mat 估计协方差的函数, 默认样本协方差 np.cov,
+        #     也可以用 Code.Estimator.Risks 中的收缩估计 ledoit_wolf_cov / oas_cov.
+        #     注册估计器(COV_ESTIMATORS)的结果由调用方估计好, 以 cov_mat / expct_rtn_rates 传入
+        assert asset_r_mat is not None or (cov_mat is not None and expct_rtn_rates is not None), \
+            "either asset_r_mat or both cov_mat and expct_rtn_rates must be given"
+
         self.assets_idlst = assets_idlst # 记录资产的排列
         self.asset_r_mat = asset_r_mat
-        self.num_assets = asset_r_mat.shape[0] # 资产个数
         self.allocated_weights = None # 初始化资产权重
         self.solve_status = "" # 初始化求解状态为空字符
 
-        self.cov_mat = np.cov(asset_r_mat)
+        if cov_mat is None:
+            cov_mat = cov_estimator(asset_r_mat)
+        elif hasattr(cov_mat, 'to_dense') and not isinstance(cov_mat, factorCovariance):
+            cov_mat = cov_mat.to_dense()
+        self.cov_mat = cov_mat
+        self.num_assets = cov_mat.shape[0] # 资产个数
+
+        # 预期收益率只算一次, portf_return 不再重复求均值
+        self.expct_rtn_rates = asset_r_mat.mean(axis=1) if expct_rtn_rates is None else expct_rtn_rates
 
         self.tgt_contrib_ratio = tgt_contrib_ratio
         self.category_mat = category_mat
@@ -40,7 +239,7 @@ class RiskParity:
         if category_mat is not None:
             self.num_risk = category_mat.shape[0]
         else:
-            self.num_risk = asset_r_mat.shape[0]
+            self.num_risk = self.num_assets
     
     @staticmethod
     def cal_portf_var(w:np.array, V:np.array):
@@ -49,25 +248,21 @@ class RiskParity:
     
     @property
     def portf_return(self):
-        return self.allocated_weights @ self.asset_r_mat.mean(axis=1)
+        return self.allocated_weights @ self.expct_rtn_rates
     
     def cal_optimal_obj(self, risk_contribs:np.array, tgt_contrib_ratio:np.array=None):
         # risk_contribs: 各资产/风险因子/资产类别 的trc向量, 即各资产/风险因子/资产类别贡献的风险。
         # tgt_contrib_ratio: 希望各资产/风险因子/资产类别 风险贡献的目标比例。不输入时，默认各资产/风险因子/资产类别平均分担总风险
-        if tgt_contrib_ratio is None:
-            tgt_contrib_ratio = np.array([ 1.0/self.num_risk ]*self.num_risk)
-
-        assert len(tgt_contrib_ratio) == self.num_risk, "risk_contribs and tgt_contrib_ratio must have same length"
-        assert np.abs( tgt_contrib_ratio.sum() - 1 ) <= 0.01, "tgt_contrib_ratio must be summed to 1"
         # 使用risk_contribs 和 tgt_contrib_ratio 对比, 得到最优化objective函数
         if tgt_contrib_ratio is not None:
+            assert len(tgt_contrib_ratio) == self.num_risk, "risk_contribs and tgt_contrib_ratio must have same length"
+            assert np.abs( tgt_contrib_ratio.sum() - 1 ) <= 0.01, "tgt_contrib_ratio must be summed to 1"
             tgt_contribs = tgt_contrib_ratio * np.sum(risk_contribs)
             obj = np.sum( np.square(risk_contribs - tgt_contribs) )
-        # 当 tgt_contrib_ratio = None时，使用risk_contribs 自身作对比使得各分量基本相等
+        # 当 tgt_contrib_ratio = None时，使用risk_contribs 自身作对比使得各分量基本相等:
+        # 两两之差的平方和 sum_ij (rc_i - rc_j)^2 = 2m * sum_i (rc_i - mean(rc))^2, O(m) 计算, 不构造 m x m 矩阵
         else:
-            risk_contribs = risk_contribs.reshape(-1, 1)
-            ones = np.ones_like(risk_contribs)
-            obj = np.sum( np.square(risk_contribs @ ones.T - ones @ risk_contribs.T) )
+            obj = 2 * self.num_risk * np.sum( np.square(risk_contribs - np.mean(risk_contribs)) )
         return obj
     
     @staticmethod
@@ -91,20 +286,129 @@ class RiskParity:
         risk_contribs = self.cal_risk_contribs(w, V, category_mat)
         return self.cal_optimal_obj(risk_contribs, tgt_contrib_ratio)
     
+    def jac_func_on_assets(self, w, params):
+        # obj_func_on_assets 的解析梯度, params 同上. 记 rc = C @ (w * Vw), S = sum(rc) = w @ V @ w,
+        # e = rc - t * S, u = C.T @ e (C 为 category_mat, 无类别时为单位阵), 则
+        # d obj / dw = 2 * (Vw * u + V @ (w * u)) - 4 * (t @ e) * Vw
+        # 每次只需 2 次 O(n^2) 矩阵向量乘, 替代有限差分的 n+1 次目标函数求值
+        # 等风险目标(t = None)即 t = 1/m 时的 2m 倍
+        V, category_mat, tgt_contrib_ratio = params
+        scale = 1.0
+        if tgt_contrib_ratio is None:
+            tgt_contrib_ratio = np.array([ 1.0/self.num_risk ]*self.num_risk)
+            scale = 2.0 * self.num_risk
+        Vw = V @ w
+        risk_contribs = self.cal_risk_contribs(w, V, category_mat)
+        err = risk_contribs - tgt_contrib_ratio * np.sum(risk_contribs)
+        u = err if category_mat is None else category_mat.T @ err
+        return scale * ( 2 * (Vw * u + V @ (w * u)) - 4 * (tgt_contrib_ratio @ err) * Vw )
+
     def obj_func_on_factor(self, w, params):
         pass
 
-    def optimal_solver(self):
-        w0 = np.array([1/self.num_assets ] * self.num_assets ) # 初始值 均分
-        cons = ({'type': 'eq', 'fun': total_weight_constraint},
-                {'type': 'ineq', 'fun':loan_only_constraint})
-        res = scipyopt.minimize(self.obj_func_on_assets, w0,
+    def optimal_solver(self, method:str='slsqp', w0:np.array=None):
+        # method: 'slsqp' 为通用的平方和目标 + scipy SLSQP(默认);
+        # 'newton' 用 risk_budget_newton 求解资产维度的风险平价/预算. 按资产类别(category_mat)做风险预算,
+        # 或风险预算含非正项(对数障碍法不适用)时, 仍用 SLSQP
+        # w0: 初始权重, 不输入时均分. 滚动求解时可传入上一窗口的解
+        if method == 'newton' and self.__newton_applicable(self.category_mat, self.tgt_contrib_ratio):
+            budgets = np.ones(self.num_assets) if self.tgt_contrib_ratio is None else self.tgt_contrib_ratio
+            res = risk_budget_newton(self.cov_mat, budgets, w0)
+            self.allocated_weights = res['x']
+            self.solve_status = res['status']
+            return {"portf_w": res['x'], "portf_var": self.risk_contribs.sum(), "portf_rtn": self.portf_return,
+                    "risk_contribs": self.risk_contribs, "solve_status": self.solve_status}
+
+        if w0 is None:
+            w0 = np.array([1/self.num_assets ] * self.num_assets ) # 初始值 均分
+        cons = ({'type': 'eq', 'fun': total_weight_constraint, 'jac': total_weight_constraint_jac},
+                {'type': 'ineq', 'fun':loan_only_constraint, 'jac': loan_only_constraint_jac})
+        res = scipyopt.minimize(self.obj_func_on_assets, w0, jac=self.jac_func_on_assets,
                                 args=[self.cov_mat, self.category_mat, self.tgt_contrib_ratio],
                                 method='SLSQP', constraints=cons, options={'disp':True})
         self.allocated_weights = res.x
         self.solve_status = 'optimal' if res.success else 'unknown'
         return {"portf_w": res.x, "portf_var": self.risk_contribs.sum(), "portf_rtn": self.portf_return,
                 "risk_contribs": self.risk_contribs, "solve_status": self.solve_status}
+
+    @staticmethod
+    def __newton_applicable(category_mat:np.array, tgt_contrib_ratio:np.array) -> bool:
+        # 对数障碍法只能求解资产维度、风险预算全为正的问题
+        return category_mat is None and (tgt_contrib_ratio is None or bool(np.all(tgt_contrib_ratio > 0)))
+
+    @staticmethod
+    def solve_rolling_batch(train_rtn_stack:np.array, category_mat:np.array=None, tgt_contrib_ratio:np.array=None,
+                            assets_idlst:list=[], cov_estimator:t.Callable=None,
+                            window_moments:t.List[tuple]=None, num_chains:int=None) -> t.List[riskParitySolveRes]:
+        '''
+        滚动窗口的风险平价/预算, 一次性求解一组窗口
+        input:
+            train_rtn_stack: shape (num_windows, num_assets, window_size)
+        return:
+            list of riskParitySolveRes, 每个窗口一条, 与 MeanVarOpt.solve_unbounds_batch 的结果列表对应
+
+        每个窗口都以上一窗口的权重为初始值(热启动):
+        资产维度(category_mat 为 None)的风险预算: 批量计算各窗口协方差 (num_windows, n, n),
+        用 risk_budget_newton_rolling 分链接力, 每轮各链的窗口一起做向量化的 newton 迭代.
+        num_chains 见 risk_budget_newton_rolling.
+        按资产类别或含非正项的风险预算只能用 SLSQP 逐窗口求解, 每个窗口以上一窗口的权重为初始值.
+        cov_estimator: 批量协方差估计(如 Code.Estimator.Risks 的 ledoit_wolf_cov / oas_cov), 不输入时用样本协方差
+        window_moments: 调用方已估计好的各窗口 (mean, cov) 列表(如 COV_ESTIMATORS 中估计器的结果, 与 MeanVarOpt
+            共用), 输入时不再估计协方差. 因子模型协方差(factorCovariance)逐窗口用 Woodbury 形式的 newton 求解
+        '''
+        num_windows, num_assets, window_size = train_rtn_stack.shape
+
+        rtn_rates = train_rtn_stack.mean(axis=2)
+        cov_list = None
+        if window_moments is not None:
+            assert len(window_moments) == num_windows, 'window_moments must match windows of train_rtn_stack'
+            rtn_rates = np.stack([mean for mean, _ in window_moments], axis=0)
+            cov_list = [cov_mat for _, cov_mat in window_moments]
+            cov_stack = np.stack(cov_list, axis=0) if all(isinstance(V, np.ndarray) for V in cov_list) else None
+        elif cov_estimator is None:
+            demeaned = train_rtn_stack - rtn_rates[:, :, None]
+            cov_stack = demeaned @ demeaned.transpose(0, 2, 1) / (window_size - 1)
+        else:
+            cov_stack = cov_estimator(train_rtn_stack)
+
+        use_newton = RiskParity.__newton_applicable(category_mat, tgt_contrib_ratio)
+        if use_newton and cov_stack is None:
+            # 因子模型协方差不堆叠成稠密矩阵, 逐窗口求解, 以上一窗口的解热启动
+            budgets = np.ones(num_assets) if tgt_contrib_ratio is None else tgt_contrib_ratio
+            res_list, w0 = [], None
+            for V in cov_list:
+                res = risk_budget_newton(V, budgets, w0)
+                w0 = res['x'] if res['status'] == 'optimal' else None
+                res_list.append(res)
+            portf_w, status = np.stack([res['x'] for res in res_list], axis=0), [res['status'] for res in res_list]
+            risk_contribs = [w * (V @ w) for w, V in zip(portf_w, cov_list)]
+        elif use_newton:
+            budgets = np.ones(num_assets) if tgt_contrib_ratio is None else tgt_contrib_ratio
+            res = risk_budget_newton_rolling(cov_stack, budgets, num_chains)
+            portf_w, status = res['x'], res['status']
+            risk_contribs = portf_w * np.einsum('wij,wj->wi', cov_stack, portf_w)
+        else:
+            portf_w, status, risk_contribs = [], [], []
+            w0 = None
+            for i in range(num_windows):
+                rp = RiskParity(None, category_mat, tgt_contrib_ratio, assets_idlst,
+                                cov_mat=cov_stack[i] if cov_list is None else cov_list[i],
+                                expct_rtn_rates=rtn_rates[i])
+                cur_res = rp.optimal_solver('slsqp', w0)
+                portf_w.append(cur_res['portf_w'])
+                status.append(cur_res['solve_status'])
+                risk_contribs.append(cur_res['risk_contribs'])
+                if cur_res['solve_status'] == 'optimal':
+                    w0 = cur_res['portf_w']
+            portf_w = np.stack(portf_w, axis=0)
+
+        portf_rtn = np.einsum('wn,wn->w', portf_w, rtn_rates)
+        portf_var = np.einsum('wi,wij,wj->w', portf_w, cov_stack, portf_w) if cov_stack is not None else \
+            np.array([w @ (V @ w) for w, V in zip(portf_w, cov_list)])
+
+        return [{'portf_w': portf_w[i], 'portf_rtn': portf_rtn[i], 'portf_var': portf_var[i],
+                 'risk_contribs': risk_contribs[i], 'solve_status': status[i], 'assets_idlst': assets_idlst}
+                for i in range(num_windows)]
     
 
 
@@ -124,4 +428,24 @@ if __name__ == "__main__":
     w_rb = fin.optimal_solver()
     print('asset weights: ', w_rb)
     print('risk contributions: ', fin.risk_contribs)
-    print('portf return: ', fin.portf_return)
\ No newline at end of file
+    print('portf return: ', fin.portf_return)
+    # benchmark: 等风险目标, 两两差矩阵写法 vs O(n) 写法的峰值内存与耗时
+    import time
+    import tracemalloc
+    n = 2000
+    rc = np.random.uniform(size=n)
+    def pairwise_obj(rc):
+        rc = rc.reshape(-1, 1)
+        ones = np.ones_like(rc)
+        return np.sum( np.square(rc @ ones.T - ones @ rc.T) )
+    fin = RiskParity(np.random.normal(size=(n, 3)))
+    for name, func in [('pairwise', pairwise_obj), ('O(n)', fin.cal_optimal_obj)]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        for _ in range(20):
+            obj = func(rc)
+        cost = (time.perf_counter() - start) / 20
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('{name}: obj {obj:.6f}, {cost:.6f}s per call, peak alloc {peak:.2f}MB'.format(
+            name=name, obj=obj, cost=cost, peak=peak/1e6))
@@ -1 +1,877 @@
+import hashlib
 import numpy as np
+import typing as t
+from Code.Utils.LinAlg import factorCovariance
+
+
+
+
+## 滚动窗口的均值/协方差: 维护累加和, 窗口滑动时只加入新列、移除旧列
+class rollingCovariance:
+    '''
+    running sums over the columns (days) currently in the window:
+        s1 = sum(x - shift), s2 = sum( (x - shift) @ (x - shift).T )
+    mean = shift + s1 / m, cov = ( s2 - s1 @ s1.T / m ) / (m - 1), same as np.cov (ddof=1)
+
+    adding / removing g columns is a rank-g update costing O(n^2 g), instead of O(n^2 window) of np.cov.
+    shift is the mean of the first added columns, which keeps the running sums small and
+    avoids cancellation in s2 - s1 @ s1.T / m.
+
+    attributes:
+        1. count
+        2. mean
+        3. cov
+    methods:
+        1. add(cols)
+        2. remove(cols)
+        3. slide(add_cols, remove_cols)
+        4. from_windows(train_rtn_mat_list, stride)
+        5. snapshots(rtn_data, rebal_idx, window_size)
+    '''
+
+    __slots__ = ("__num_assets", "__count", "__shift", "__sum", "__sum_outer")
+
+
+    def __init__(
+            self,
+            num_assets: int
+            ) -> None:
+
+        self.__num_assets = num_assets
+        self.__count = 0
+        self.__shift = None
+        self.__sum = np.zeros(num_assets)
+        self.__sum_outer = np.zeros((num_assets, num_assets))
+
+
+    def add(
+            self,
+            cols: np.ndarray
+            ) -> None:
+        # cols: shape (num_assets, num_cols). 取数得到的是 float32, 累加和必须用 float64 计算
+        cols = np.asarray(cols, dtype=np.float64)
+        if self.__shift is None:
+            self.__shift = cols.mean(axis=1)
+
+        centered = cols - self.__shift[:, None]
+        self.__sum += centered.sum(axis=1)
+        self.__sum_outer += centered @ centered.T
+        self.__count += cols.shape[1]
+
+
+    def remove(
+            self,
+            cols: np.ndarray
+            ) -> None:
+        assert cols.shape[1] <= self.__count, "cannot remove more columns than the window holds"
+
+        cols = np.asarray(cols, dtype=np.float64)
+        centered = cols - self.__shift[:, None]
+        self.__sum -= centered.sum(axis=1)
+        self.__sum_outer -= centered @ centered.T
+        self.__count -= cols.shape[1]
+
+
+    def slide(
+            self,
+            add_cols: np.ndarray,
+            remove_cols: np.ndarray
+            ) -> None:
+        # 加入 add_cols 同时移除 remove_cols, 即窗口向后滑动
+        # 两个秩更新各自用 x @ x.T 计算(保证 s2 严格对称), 合并后一次累加到 s2
+        assert remove_cols.shape[1] <= self.__count, "cannot remove more columns than the window holds"
+
+        add_cols = np.asarray(add_cols, dtype=np.float64)
+        remove_cols = np.asarray(remove_cols, dtype=np.float64)
+        add_centered = add_cols - self.__shift[:, None]
+        remove_centered = remove_cols - self.__shift[:, None]
+        self.__sum += add_centered.sum(axis=1) - remove_centered.sum(axis=1)
+        update = add_centered @ add_centered.T
+        update -= remove_centered @ remove_centered.T
+        self.__sum_outer += update
+        self.__count += add_cols.shape[1] - remove_cols.shape[1]
+
+
+    @property
+    def count(self) -> int:
+        return self.__count
+
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self.__shift + self.__sum / self.__count
+
+
+    @property
+    def cov(self) -> np.ndarray:
+        assert self.__count > 1, "covariance needs at least 2 columns in the window"
+
+        return (self.__sum_outer - np.outer(self.__sum, self.__sum) / self.__count) / (self.__count - 1)
+
+
+    @classmethod
+    def from_windows(
+            cls,
+            train_rtn_mat_list: t.List[np.ndarray],
+            stride: int
+            ) -> t.Iterator[t.Tuple[np.ndarray, np.ndarray]]:
+        '''
+        train_rtn_mat_list: rolling windows of shape (num_assets, window_size), each one starting
+            stride columns after the previous one (e.g. train windows of get_train_hold_rtn_data, stride = gapday)
+        yield:
+            (mean, cov) of every window, in order
+        '''
+        engine = None
+        prev = None
+        for train_rtn_mat in train_rtn_mat_list:
+            window_size = train_rtn_mat.shape[1]
+
+            if prev is None or stride >= window_size or prev.shape[1] != window_size:
+                # 首个窗口, 或相邻窗口不重叠: 从头累加
+                engine = cls(train_rtn_mat.shape[0])
+                engine.add(train_rtn_mat)
+            else:
+                engine.slide(train_rtn_mat[:, -stride:], prev[:, :stride])
+
+            prev = train_rtn_mat
+            yield engine.mean, engine.cov
+
+
+    @classmethod
+    def snapshots(
+            cls,
+            rtn_data: np.ndarray,
+            rebal_idx: t.Sequence[int],
+            window_size: int
+            ) -> t.Iterator[t.Tuple[np.ndarray, np.ndarray]]:
+        '''
+        rtn_data: shape (num_assets, num_days), the whole panel (e.g. all_rtn_data of get_panel_hold_rtn_data)
+        rebal_idx: increasing columns of the rebalance days
+        yield:
+            (mean, cov) of the window_size columns before every rebalance day, in order.
+            the window slides on the panel, no overlapping train windows are sliced out.
+        '''
+        engine = None
+        prev_idx = None
+        for idx in rebal_idx:
+            assert window_size <= idx <= rtn_data.shape[1], "window before rebalance day out of the panel"
+
+            if prev_idx is None or idx - prev_idx >= window_size:
+                # 首个窗口, 或相邻窗口不重叠: 从头累加
+                engine = cls(rtn_data.shape[0])
+                engine.add(rtn_data[:, idx-window_size:idx])
+            else:
+                assert idx >= prev_idx, "rebal_idx must be increasing"
+                engine.slide(rtn_data[:, prev_idx:idx], rtn_data[:, prev_idx-window_size:idx-window_size])
+
+            prev_idx = idx
+            yield engine.mean, engine.cov
+
+
+
+
+## 指数加权的均值/协方差: 逐日消费收益率列, 不保留窗口数据
+class ewmaCovariance:
+    '''
+    exponentially weighted mean & covariance, weight of the day k days ago is decay^k.
+    one day x costs O(n^2) (West, 1979, weighted incremental update):
+        W <- decay * W + 1, W2 <- decay^2 * W2 + 1
+        d = x - mean, mean <- mean + d / W
+        S <- decay * S + (1 - 1/W) * d @ d.T
+    mean = sum(w x) / W, cov = S / (W - W2 / W), unbiased for reliability weights.
+    decay = 1 gives the equal weighted np.mean / np.cov (ddof=1) of all days consumed.
+
+    no window buffer: the state is (mean, S, W, W2) only, whatever the number of days.
+
+    attributes:
+        1. count
+        2. mean
+        3. cov
+        4. effective_size
+    methods:
+        1. update(col)
+        2. consume(cols)
+        3. snapshots(rtn_data, rebal_idx, decay, halflife)
+    '''
+
+    __slots__ = ("__decay", "__count", "__weight", "__weight_sq", "__mean", "__scatter")
+
+
+    def __init__(
+            self,
+            num_assets: int,
+            decay: float = 0.94,
+            halflife: t.Union[float, None] = None
+            ) -> None:
+        # 给出 halflife 时, decay = 0.5^(1/halflife), 即 halflife 天前的权重减半
+        if halflife is not None:
+            assert halflife > 0, "halflife must be positive"
+            decay = 0.5 ** (1.0 / halflife)
+
+        assert 0 < decay <= 1, "decay must be in (0, 1]"
+
+        self.__decay = decay
+        self.__count = 0
+        self.__weight = 0.0
+        self.__weight_sq = 0.0
+        self.__mean = np.zeros(num_assets)
+        self.__scatter = np.zeros((num_assets, num_assets))
+
+
+    def update(
+            self,
+            col: np.ndarray
+            ) -> None:
+        # col: 一天的收益率, shape (num_assets,)
+        self.__weight = self.__decay * self.__weight + 1.0
+        self.__weight_sq = self.__decay * self.__decay * self.__weight_sq + 1.0
+
+        diff = col - self.__mean
+        self.__mean += diff / self.__weight
+        # S 原地衰减后加秩一更新
+        self.__scatter *= self.__decay
+        self.__scatter += (1.0 - 1.0 / self.__weight) * np.outer(diff, diff)
+        self.__count += 1
+
+
+    def consume(
+            self,
+            cols: np.ndarray
+            ) -> None:
+        # cols: shape (num_assets, num_days), 按时间顺序逐日更新
+        for col in cols.T:
+            self.update(col)
+
+
+    @property
+    def count(self) -> int:
+        return self.__count
+
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self.__mean.copy()
+
+
+    @property
+    def cov(self) -> np.ndarray:
+        assert self.__count > 1, "covariance needs at least 2 days"
+
+        return self.__scatter / (self.__weight - self.__weight_sq / self.__weight)
+
+
+    @property
+    def effective_size(self) -> float:
+        # 有效样本数 W^2 / W2, decay = 1 时等于天数
+        return self.__weight * self.__weight / self.__weight_sq
+
+
+    @classmethod
+    def snapshots(
+            cls,
+            rtn_data: np.ndarray,
+            rebal_idx: t.Sequence[int],
+            decay: float = 0.94,
+            halflife: t.Union[float, None] = None
+            ) -> t.Iterator[t.Tuple[np.ndarray, np.ndarray]]:
+        '''
+        rtn_data: shape (num_assets, num_days), the whole panel (e.g. all_rtn_data of get_panel_hold_rtn_data)
+        rebal_idx: increasing columns of the rebalance days (e.g. rebal_idx of get_panel_hold_rtn_data)
+        yield:
+            (mean, cov) estimated from columns before every rebalance day, in order.
+            every column is consumed once, no overlapping train windows are sliced out.
+        '''
+        engine = cls(rtn_data.shape[0], decay, halflife)
+        consumed = 0
+        for idx in rebal_idx:
+            assert idx >= consumed, "rebal_idx must be increasing"
+
+            engine.consume(rtn_data[:, consumed:idx])
+            consumed = idx
+            yield engine.mean, engine.cov
+
+
+
+
+# 特质方差的下限(相对各资产总方差), 保证 factorCovariance 可逆
+_SPECIFIC_VAR_FLOOR = 1e-6
+
+
+
+
+## 统计因子(PCA)协方差: 随机化截断 SVD 提取 k 个因子, 返回 B @ F @ B.T + D 的结构化协方差
+class pcaFactorCovariance:
+    '''
+    statistical factor model of a window X (num_assets, num_days), demeaned and scaled by 1/sqrt(T-1):
+        S = X @ X.T ~ U_k @ diag(lambda_k) @ U_k.T + diag(d),  d = diag(S) - sum_j lambda_j U_ij^2
+    the top k eigenpairs come from a randomized truncated SVD (Halko et al., 2011) on a subspace of
+    l = k + oversample columns:
+        Q = orth( (X @ X.T)^q @ Omega ), svd of the small (l, T) matrix Q.T @ X
+    costing O(n T l) per window; the n x n sample covariance is never formed.
+
+    warm start: consecutive rolling windows share most of their days, so the subspace of the previous
+    window is used as Omega instead of a random matrix, and power_iter steps of subspace iteration
+    refine it. the first window (or a window with another number of assets) starts from a gaussian Omega.
+
+    attributes:
+        1. num_factors
+        2. subspace: (n, l) orthonormal basis kept for the next window
+        3. eigvals: top k eigenvalues of the last window
+    methods:
+        1. __call__(rtn_mat) -> factorCovariance
+        2. from_windows(train_rtn_mat_list, num_factors, ...)
+    '''
+
+    __slots__ = ("__num_factors", "__oversample", "__power_iter", "__rng", "__subspace", "__eigvals")
+
+
+    def __init__(
+            self,
+            num_factors: int,
+            oversample: int = 10,
+            power_iter: int = 2,
+            seed: t.Union[int, None] = None
+            ) -> None:
+
+        assert num_factors > 0, "num_factors must be positive"
+
+        self.__num_factors = num_factors
+        self.__oversample = oversample
+        self.__power_iter = power_iter
+        self.__rng = np.random.default_rng(seed)
+        self.__subspace = None
+        self.__eigvals = None
+
+
+    @property
+    def num_factors(self) -> int:
+        return self.__num_factors
+
+
+    @property
+    def subspace(self) -> t.Union[np.ndarray, None]:
+        return self.__subspace
+
+
+    @property
+    def eigvals(self) -> t.Union[np.ndarray, None]:
+        return self.__eigvals
+
+
+    def __call__(
+            self,
+            rtn_mat: np.ndarray
+            ) -> factorCovariance:
+        '''
+        rtn_mat: shape (num_assets, num_days)
+        return:
+            factorCovariance B @ F @ B.T + diag(d), B = U_k, F = diag(lambda_k)
+        '''
+        num_assets, num_days = rtn_mat.shape
+        num_factors = min(self.__num_factors, num_assets, num_days - 1)
+        num_cols = min(num_factors + self.__oversample, num_assets, num_days)
+
+        scaled = (rtn_mat - rtn_mat.mean(axis=1, keepdims=True)) / np.sqrt(num_days - 1)
+
+        if self.__subspace is None or self.__subspace.shape != (num_assets, num_cols):
+            omega = self.__rng.standard_normal((num_assets, num_cols))
+        else:
+            omega = self.__subspace
+
+        # 子空间迭代, 每步正交化以免小奇异值方向被淹没
+        basis = np.linalg.qr( scaled @ (scaled.T @ omega) )[0]
+        for _ in range(self.__power_iter):
+            basis = np.linalg.qr( scaled @ (scaled.T @ basis) )[0]
+
+        left, sing, _ = np.linalg.svd(basis.T @ scaled, full_matrices=False)
+        # 按奇异值排序后的整个子空间留给下一个窗口热启动
+        self.__subspace = basis @ left
+
+        loadings = self.__subspace[:, :num_factors]
+        self.__eigvals = np.square(sing[:num_factors])
+
+        total_var = np.einsum('ij,ij->i', scaled, scaled)
+        specific_var = np.maximum(total_var - np.square(loadings) @ self.__eigvals,
+                                  _SPECIFIC_VAR_FLOOR * total_var)
+
+        return factorCovariance(loadings, np.diag(self.__eigvals), specific_var)
+
+
+    @classmethod
+    def from_windows(
+            cls,
+            train_rtn_mat_list: t.List[np.ndarray],
+            num_factors: int,
+            oversample: int = 10,
+            power_iter: int = 2,
+            seed: t.Union[int, None] = None
+            ) -> t.Iterator[t.Tuple[np.ndarray, factorCovariance]]:
+        '''
+        yield:
+            (mean, factorCovariance) of every window in order, each window warm started from the previous one
+        '''
+        estimator = cls(num_factors, oversample, power_iter, seed)
+        for train_rtn_mat in train_rtn_mat_list:
+            yield train_rtn_mat.mean(axis=1), estimator(train_rtn_mat)
+
+
+
+
+def ledoit_wolf_cov(
+        rtn_mat: np.ndarray,
+        return_intensity: bool = False
+        ) -> t.Union[np.ndarray, t.Tuple[np.ndarray, np.ndarray]]:
+    '''
+    Ledoit-Wolf shrinkage towards the constant-correlation target (Ledoit & Wolf, 2003, "Honey, I shrunk
+    the sample covariance matrix"), batched over any leading dimensions.
+    input:
+        rtn_mat: shape (..., num_assets, num_days), e.g. (num_windows, num_assets, window_size)
+    return:
+        cov: shape (..., num_assets, num_assets), delta * F + (1 - delta) * S
+        intensity: shape (...), optimal shrinkage intensity delta, if return_intensity
+
+    F_ij = r_bar * sqrt(s_ii * s_jj) (F_ii = s_ii), r_bar is the average sample correlation.
+    delta = clip( (pi - rho) / gamma / T, 0, 1 ), all terms are O(n^2 T) matrix products, no loop over windows.
+    The intensity follows the paper (S with 1/T); the result is rescaled to ddof=1, so delta = 0 gives np.cov.
+    '''
+    num_assets, num_days = rtn_mat.shape[-2], rtn_mat.shape[-1]
+    demeaned = rtn_mat - rtn_mat.mean(axis=-1, keepdims=True)
+    demeaned_t = np.swapaxes(demeaned, -1, -2)
+
+    sample = demeaned @ demeaned_t / num_days
+
+    # 单个资产没有两两相关系数, 目标矩阵即样本方差, 不收缩
+    if num_assets < 2:
+        cov = sample * num_days / (num_days - 1)
+        return (cov, np.zeros(sample.shape[:-2])) if return_intensity else cov
+
+    var = np.einsum('...ii->...i', sample)
+    std = np.sqrt(var)
+    outer_std = std[..., :, None] * std[..., None, :]
+
+    # 平均相关系数 r_bar (不含对角线). 零方差资产(如停牌)与其他资产的相关系数按 0 计, 避免 0/0
+    corr = np.divide(sample, outer_std, out=np.zeros_like(sample), where=outer_std > 0)
+    corr_sum = np.sum(corr, axis=(-2, -1)) - np.einsum('...ii->...', corr)
+    r_bar = corr_sum / (num_assets * (num_assets - 1))
+
+    target = r_bar[..., None, None] * outer_std
+    diag_idx = np.arange(num_assets)
+    target[..., diag_idx, diag_idx] = var
+
+    # pi_ij = 1/T sum_t (x_it x_jt - s_ij)^2
+    sq = np.square(demeaned)
+    pi_mat = sq @ np.swapaxes(sq, -1, -2) / num_days - np.square(sample)
+    pi_hat = np.sum(pi_mat, axis=(-2, -1))
+
+    # theta_ij = 1/T sum_t (x_it^2 - s_ii)(x_it x_jt - s_ij) = 1/T sum_t x_it^3 x_jt - s_ii s_ij
+    theta = (sq * demeaned) @ demeaned_t / num_days - var[..., :, None] * sample
+    # sqrt(s_jj / s_ii), 零方差资产 i 的 theta_ij 恒为 0, 比值取 0
+    denom_std = np.broadcast_to(std[..., :, None], theta.shape)
+    ratio = np.divide(np.broadcast_to(std[..., None, :], theta.shape), denom_std,
+                      out=np.zeros_like(theta), where=denom_std > 0)
+    off_diag = np.sum(ratio * theta, axis=(-2, -1)) - np.einsum('...ii->...', theta)
+    rho_hat = np.einsum('...ii->...', pi_mat) + r_bar * off_diag
+
+    gamma_hat = np.sum(np.square(target - sample), axis=(-2, -1))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intensity = np.clip( (pi_hat - rho_hat) / gamma_hat / num_days, 0.0, 1.0 )
+    # gamma = 0 即样本协方差已等于目标, 无需收缩
+    intensity = np.where(gamma_hat > 0, intensity, 0.0)
+
+    delta = intensity[..., None, None]
+    cov = (delta * target + (1.0 - delta) * sample) * num_days / (num_days - 1)
+
+    return (cov, intensity) if return_intensity else cov
+
+
+
+
+def oas_cov(
+        rtn_mat: np.ndarray,
+        return_intensity: bool = False
+        ) -> t.Union[np.ndarray, t.Tuple[np.ndarray, np.ndarray]]:
+    '''
+    Oracle Approximating Shrinkage towards the scaled identity (Chen et al., 2010), batched over
+    any leading dimensions.
+    input:
+        rtn_mat: shape (..., num_assets, num_days)
+    return:
+        cov: shape (..., num_assets, num_assets), delta * mu * I + (1 - delta) * S, mu = tr(S) / n
+        intensity: shape (...), if return_intensity
+
+    The intensity uses S with 1/T as in the paper, the result is rescaled to ddof=1 like ledoit_wolf_cov.
+    '''
+    num_assets, num_days = rtn_mat.shape[-2], rtn_mat.shape[-1]
+    demeaned = rtn_mat - rtn_mat.mean(axis=-1, keepdims=True)
+    sample = demeaned @ np.swapaxes(demeaned, -1, -2) / num_days
+
+    mu = np.einsum('...ii->...', sample) / num_assets
+    alpha = np.mean(np.square(sample), axis=(-2, -1))
+
+    num = alpha + np.square(mu)
+    den = (num_days + 1.0) * (alpha - np.square(mu) / num_assets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intensity = np.where(den > 0, np.minimum(num / den, 1.0), 1.0)
+
+    delta = intensity[..., None, None]
+    cov = (1.0 - delta) * sample
+    diag_idx = np.arange(num_assets)
+    cov[..., diag_idx, diag_idx] += intensity[..., None] * mu[..., None]
+    cov *= num_days / (num_days - 1)
+
+    return (cov, intensity) if return_intensity else cov
+
+
+
+
+# 按名称选择的收缩估计, 输入 (..., num_assets, num_days), 返回 (..., num_assets, num_assets)
+SHRINKAGE_COV = {
+    'ledoit_wolf': ledoit_wolf_cov,
+    'oas': oas_cov
+}
+
+
+
+
+# 各窗口估计结果的缓存, key 为 (面板摘要, 窗口起点, 窗口长度, 步长, 估计器名称, 参数).
+# 按占用字节数设上限, 超过时淘汰最早写入的窗口
+_COV_CACHE_MAXBYTES = 1 << 30
+
+
+
+
+class _momentCache:
+    # (mean, cov) 的 FIFO 缓存, 存入的数组设为只读, 各策略共用时不会被就地修改
+    __slots__ = ("__items", "__nbytes", "__max_nbytes")
+
+
+    def __init__(self, max_nbytes: int) -> None:
+        self.__items = {}
+        self.__nbytes = 0
+        self.__max_nbytes = max_nbytes
+
+
+    @staticmethod
+    def __arrays(moment: tuple) -> t.List[np.ndarray]:
+        mean, cov = moment
+        if isinstance(cov, factorCovariance):
+            return [mean, cov.scaled_loadings, cov.specific_var]
+        return [mean, cov]
+
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.__items
+
+
+    def __getitem__(self, key: tuple) -> tuple:
+        return self.__items[key][0]
+
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+
+    @property
+    def nbytes(self) -> int:
+        return self.__nbytes
+
+
+    def put(self, key: tuple, moment: tuple) -> None:
+        arrays = self.__arrays(moment)
+        for arr in arrays:
+            arr.setflags(write=False)
+        nbytes = sum(arr.nbytes for arr in arrays)
+
+        if key in self.__items:
+            self.__nbytes -= self.__items.pop(key)[1]
+        self.__items[key] = (moment, nbytes)
+        self.__nbytes += nbytes
+
+        # 至少保留刚写入的一项
+        while self.__nbytes > self.__max_nbytes and len(self.__items) > 1:
+            self.__nbytes -= self.__items.pop(next(iter(self.__items)))[1]
+
+
+    def clear(self) -> None:
+        self.__items.clear()
+        self.__nbytes = 0
+
+
+
+
+_COV_CACHE = _momentCache(_COV_CACHE_MAXBYTES)
+
+
+
+
+def _panel_digest(
+        rtn_data: np.ndarray
+        ) -> str:
+    # 面板数据的摘要, 每天的数据只读一次
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.array(rtn_data.shape).tobytes())
+    digest.update(np.ascontiguousarray(rtn_data, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+
+
+def _hashable_param(value: t.Any) -> t.Hashable:
+    # 估计器参数转为可哈希的缓存 key: 数组/列表转为元组, numpy 标量转为 python 标量
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable_param(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable_param(v)) for k, v in value.items()))
+    hash(value)
+    return value
+
+
+
+
+## 协方差估计器的统一接口
+class covEstimator:
+    '''
+    protocol of covariance estimators selectable by name (COV_ESTIMATORS, get_cov_estimator):
+        estimator(rtn_data, rebal_idx, window_size, panel_key=None) -> list of (mean, cov), one per rebalance day
+        estimator(rtn_data, rebal_idx, window_size, panel_key, index) -> (mean, cov) of rebalance day index
+    rtn_data: the whole panel of shape (num_assets, num_days), e.g. all_rtn_data of get_panel_hold_rtn_data
+    rebal_idx: increasing columns of the rebalance days; the train window of rebalance day i is
+        rtn_data[:, rebal_idx[i]-window_size : rebal_idx[i]] (ewma uses all days before rebal_idx[i])
+    cov: np.ndarray, or factorCovariance for the factor estimator
+
+    all rebalance days are estimated in one batched call (_estimate of subclasses) on the panel,
+    no overlapping train windows are materialized.
+    results are cached by (panel identity, window start, window length, name, params) across all
+    estimator instances, so strategies or parameter sweeps over the same panel estimate every window only once.
+    panel identity is panel_key if given (any cheap hashable identifying the data, e.g. assets, date range,
+    window & stride), otherwise a digest of the panel, which reads the whole panel on every call.
+    with index given (e.g. drilling down into one window), a cache miss estimates that window only:
+    exact for sample/shrinkage, ewma consumes the panel up to the rebalance day once, the factor estimator
+    starts from a seeded random subspace instead of the previous window's.
+    cached arrays are read-only; the cache is bounded by _COV_CACHE_MAXBYTES.
+
+    attributes:
+        1. name
+        2. params
+        3. key, (name, params) identifying the estimates, e.g. for caches downstream of the estimator
+    methods:
+        1. __call__(rtn_data, rebal_idx, window_size, panel_key, index)
+        2. clear_cache()
+        3. cache_size()
+    '''
+
+    __slots__ = ("__params", "__params_key")
+
+    name = ''
+
+
+    def __init__(self, **params) -> None:
+        try:
+            self.__params_key = tuple(sorted( (k, _hashable_param(v)) for k, v in params.items() ))
+        except TypeError as e:
+            raise ValueError(f'params of cov_estimator {self.name} must be hashable: {e}')
+        self.__params = params
+
+
+    @property
+    def params(self) -> dict:
+        return self.__params
+
+
+    @property
+    def key(self) -> tuple:
+        return (self.name, self.__params_key)
+
+
+    def _estimate(
+            self,
+            rtn_data: np.ndarray,
+            rebal_idx: t.Sequence[int],
+            window_size: int
+            ) -> t.List[tuple]:
+        raise NotImplementedError
+
+
+    def __call__(
+            self,
+            rtn_data: np.ndarray,
+            rebal_idx: t.Sequence[int],
+            window_size: int,
+            panel_key: t.Hashable = None,
+            index: t.Union[int, None] = None
+            ) -> t.Union[t.List[tuple], tuple]:
+
+        panel_id = _panel_digest(rtn_data) if panel_key is None else ('key', panel_key)
+        keys = [(panel_id, int(idx) - window_size, window_size, self.name, self.__params_key) for idx in rebal_idx]
+
+        if index is not None:
+            if keys[index] not in _COV_CACHE:
+                _COV_CACHE.put(keys[index], self._estimate(rtn_data, rebal_idx[index:index+1], window_size)[0])
+            return _COV_CACHE[keys[index]]
+
+        if all(key in _COV_CACHE for key in keys):
+            return [_COV_CACHE[key] for key in keys]
+
+        # 估计器在窗口间有状态(滚动累加和/EWMA/子空间热启动), 有缺失时整组重新估计
+        moments = self._estimate(rtn_data, rebal_idx, window_size)
+        for key, moment in zip(keys, moments):
+            _COV_CACHE.put(key, moment)
+
+        return moments
+
+
+    @staticmethod
+    def clear_cache() -> None:
+        _COV_CACHE.clear()
+
+
+    @staticmethod
+    def cache_size() -> int:
+        return len(_COV_CACHE)
+
+
+
+
+class sampleCovEstimator(covEstimator):
+    # 样本均值/协方差(ddof=1), 由 rollingCovariance 滚动更新
+    __slots__ = ()
+
+    name = 'sample'
+
+
+    def __init__(self) -> None:
+        super().__init__()
+
+
+    def _estimate(self, rtn_data, rebal_idx, window_size):
+        return list( rollingCovariance.snapshots(rtn_data, rebal_idx, window_size) )
+
+
+
+
+class shrinkageCovEstimator(covEstimator):
+    # 收缩估计, 所有窗口堆叠后一次批量计算. 子类给出 name(SHRINKAGE_COV 的 key)
+    __slots__ = ()
+
+
+    def __init__(self) -> None:
+        super().__init__()
+
+
+    def _estimate(self, rtn_data, rebal_idx, window_size):
+        train_rtn_stack = np.stack([rtn_data[:, idx-window_size:idx] for idx in rebal_idx], axis=0)
+        cov_stack = SHRINKAGE_COV[self.name](train_rtn_stack)
+        return list( zip(train_rtn_stack.mean(axis=2), cov_stack) )
+
+
+
+
+class ledoitWolfCovEstimator(shrinkageCovEstimator):
+    __slots__ = ()
+
+    name = 'ledoit_wolf'
+
+
+
+
+class oasCovEstimator(shrinkageCovEstimator):
+    __slots__ = ()
+
+    name = 'oas'
+
+
+
+
+class ewmaCovEstimator(covEstimator):
+    # 指数加权均值/协方差: 沿面板逐日消费, 取各调仓日的状态, window_size 不起作用
+    __slots__ = ()
+
+    name = 'ewma'
+
+
+    def __init__(
+            self,
+            decay: float = 0.94,
+            halflife: t.Union[float, None] = None
+            ) -> None:
+        super().__init__(decay=decay, halflife=halflife)
+
+
+    def _estimate(self, rtn_data, rebal_idx, window_size):
+        return list( ewmaCovariance.snapshots(rtn_data, rebal_idx, **self.params) )
+
+
+
+
+class pcaFactorCovEstimator(covEstimator):
+    # 统计因子协方差, 返回 factorCovariance. seed 固定, 保证缓存的结果可复现
+    __slots__ = ()
+
+    name = 'pca_factor'
+
+
+    def __init__(
+            self,
+            num_factors: int = 5,
+            oversample: int = 10,
+            power_iter: int = 2,
+            seed: int = 0
+            ) -> None:
+        super().__init__(num_factors=num_factors, oversample=oversample, power_iter=power_iter, seed=seed)
+
+
+    def _estimate(self, rtn_data, rebal_idx, window_size):
+        train_rtn_mat_list = [rtn_data[:, idx-window_size:idx] for idx in rebal_idx]
+        return list( pcaFactorCovariance.from_windows(train_rtn_mat_list, **self.params) )
+
+
+
+
+# 按名称选择的协方差估计器
+COV_ESTIMATORS = {
+    estimator.name: estimator for estimator in
+    [sampleCovEstimator, ledoitWolfCovEstimator, oasCovEstimator, ewmaCovEstimator, pcaFactorCovEstimator]
+}
+
+
+
+
+def get_cov_estimator(
+        name: str,
+        params: t.Union[dict, None] = None
+        ) -> covEstimator:
+    '''
+    name: key of COV_ESTIMATORS, 'sample' | 'ledoit_wolf' | 'oas' | 'ewma' | 'pca_factor'
+    params: keyword arguments of the estimator, e.g. {'halflife': 20} for 'ewma', {'num_factors': 5} for 'pca_factor'
+    '''
+    if name not in COV_ESTIMATORS:
+        raise ValueError(f'unknown cov_estimator {name}, must be one of {list(COV_ESTIMATORS)}')
+
+    try:
+        return COV_ESTIMATORS[name](**(params or {}))
+    except TypeError as e:
+        raise ValueError(f'invalid params {params} for cov_estimator {name}: {e}')
+
+
+
+
+if __name__ == "__main__":
+    # 滚动累加和 vs np.cov: float64 输入, 以及取数得到的 float32 输入(含共线资产)
+    from Code.Utils.LinAlg import covFactorization
+    np.random.seed(10)
+    x = np.random.normal(0.05, 1.5, size=(6, 300))
+    x[5] = 0.5 * x[0] + 0.25 * x[1] # 共线资产, 每个窗口的协方差都奇异
+    for dtype in [np.float64, np.float32]:
+        windows = [x[:, i:i+60].astype(dtype) for i in range(0, 240, 5)]
+        rel_err, singular = 0.0, []
+        for window, (mean, cov) in zip(windows, rollingCovariance.from_windows(windows, 5)):
+            ref = np.cov(window)
+            rel_err = max(rel_err, np.abs(cov - ref).max() / np.abs(ref).max())
+            singular.append( covFactorization(cov).is_singular == covFactorization(ref).is_singular )
+        print('{dtype}: max relative error {err:.2e}, cov dtype {cov_dtype}, singularity agrees {agree}'.format(
+            dtype=np.dtype(dtype).name, err=rel_err, cov_dtype=cov.dtype, agree=all(singular)))
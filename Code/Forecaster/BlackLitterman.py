@@ -1,3 +1,4 @@
+import typing as t
 import numpy as np
 
 
@@ -50,7 +51,7 @@ class BlackLitterman:
         '''
         if method == 'shrink':
             self._prior_cov_mat = self.prior_cov_mat_shrink(args_dict['hist_cov_mat'], args_dict['tau'])
-            self._prior_precs_mat = np.linalg.inv(self._prior_cov_mat)
+            self._prior_precs_mat = None # 后验由 woodbury 恒等式计算, 不需要精度矩阵, 用到时再求逆
         elif method == 'other':
             raise NotImplementedError('other method for assets prior covariance & precision matrix not implemented')
         else:
@@ -58,6 +59,8 @@ class BlackLitterman:
     
     @property
     def prior_precs_mat(self):
+        if self._prior_precs_mat is None and self._prior_cov_mat is not None:
+            self._prior_precs_mat = np.linalg.inv(self._prior_cov_mat)
         return self._prior_precs_mat
     
     @property
@@ -70,16 +73,15 @@ class BlackLitterman:
         '''
         if method == 'default':
             self._view_var_mat = self.view_var_mat_diag(self._view_pick_mat, self._prior_cov_mat)
-            self._view_precs_mat = np.diag( 1.0 / np.diag(self._view_var_mat) )
         elif method == 'default-nondiag':
             self._view_var_mat = self.view_var_mat_diag(self._view_pick_mat, self._prior_cov_mat, diagnal=False)
-            self._view_precs_mat = np.linalg.inv(self._view_var_mat)
         elif method == 'idzorek-confidence':
             raise NotImplementedError('confidence method for view covariance & precision matrix not implemented')
         elif method == 'residual-variance':
             raise NotImplementedError('residual-variance method for view covariance & precision matrix not implemented')
         else:
             raise ValueError('Unknown method {}'.format(method))
+        self._view_precs_mat = None # 同上, 用到时再求逆
 
     @property
     def view_var_mat(self):
@@ -87,18 +89,80 @@ class BlackLitterman:
     
     @property
     def view_precs_mat(self):
+        if self._view_precs_mat is None and self._view_var_mat is not None:
+            self._view_precs_mat = np.linalg.inv(self._view_var_mat)
         return self._view_precs_mat
 
     #### build BL model
 
-    def __call__(self, args_dict):
+    def __call__(self, args_dict, return_cov=False):
+        # return_cov=True 时同时返回后验协方差 (posterior_rtn_vec, posterior_cov_mat)
         self.set_prior_rtn_vec(args_dict)
         self.set_prior_cov_precs_mat(args_dict)
         self.set_view_cov_precs_mat(args_dict)
-        return self.EXPE_return_BL(self._prior_precs_mat, self._prior_rtn_vec, self._view_pick_mat, self._view_precs_mat, self._view_rtn_vec)
+        return self.EXPE_return_BL_woodbury(self._prior_cov_mat, self._prior_rtn_vec, self._view_pick_mat,
+                                            self._view_var_mat, self._view_rtn_vec, return_cov)
     
     #### compute functions
 
+    @staticmethod
+    def EXPE_return_BL_woodbury(prior_cov_mat:np.ndarray, prior_rtn_vec:np.ndarray, view_pick_mat:np.ndarray,
+                                view_var_mat:np.ndarray, view_rtn_vec:np.ndarray, return_cov=False):
+        '''
+        与 EXPE_return_BL 相同的后验, 由 woodbury 恒等式改写为只需 k x k 求解(k 为观点数):
+            (Phi0^-1 + P' Omega^-1 P)^-1 = Phi0 - Phi0 P' (P Phi0 P' + Omega)^-1 P Phi0
+            mu = mu0 + Phi0 P' (P Phi0 P' + Omega)^-1 (q - P mu0)
+        不构造任何精度矩阵, 主要开销是 Phi0 @ P' 的 O(n^2 k)
+        '''
+        cov_pick = prior_cov_mat @ view_pick_mat.T # Phi0 P', (n, k)
+        view_total_cov = view_pick_mat @ cov_pick + view_var_mat # P Phi0 P' + Omega, (k, k)
+        posterior_rtn_vec = prior_rtn_vec + cov_pick @ np.linalg.solve(view_total_cov, view_rtn_vec - view_pick_mat @ prior_rtn_vec)
+        if not return_cov:
+            return posterior_rtn_vec
+        posterior_cov_mat = prior_cov_mat - cov_pick @ np.linalg.solve(view_total_cov, cov_pick.T)
+        return posterior_rtn_vec, posterior_cov_mat
+
+    @classmethod
+    def batch(cls, view_pick_mat:np.ndarray, view_rtn_vec:np.ndarray, args_dict:dict, normalize=False, diagnal=True,
+              return_cov=False):
+        '''
+        批量计算 BL 后验, 不为每组观点/每个窗口重复构造模型与 set_* 过程.
+        各输入的前置维度按 numpy 广播规则对齐:
+            view_pick_mat: (k, n) 或 (num_sets, k, n)
+            view_rtn_vec: (k, ) 或 (num_sets, k)
+            args_dict['hist_cov_mat']: (n, n) 或 (num_windows, n, n)
+            args_dict['equi_wght_vec']: (n, ) 或 (num_windows, n)
+        例如多组观点 + 同一先验, 或同一组观点 + 滚动窗口的协方差栈.
+        先验均值与先验协方差在批内只计算一次, 观点不确定性 Omega 用 einsum 只取对角,
+        每组后验只需一次 k x k 求解(woodbury, 见 EXPE_return_BL_woodbury)
+
+        return:
+            posterior_rtn_vec: (..., n)
+            posterior_cov_mat: (..., n, n), return_cov=True 时返回
+        '''
+        if normalize:
+            scale = np.sqrt( np.einsum('...kn,...kn->...k', view_pick_mat, view_pick_mat) )
+            view_pick_mat, view_rtn_vec = scale[..., None] * view_pick_mat, scale * view_rtn_vec
+
+        hist_cov_mat, equi_wght_vec = args_dict['hist_cov_mat'], args_dict['equi_wght_vec']
+        prior_rtn_vec = args_dict['risk_avers_factor'] * np.einsum('...ij,...j->...i', hist_cov_mat, equi_wght_vec)
+        prior_cov_mat = cls.prior_cov_mat_shrink(hist_cov_mat, args_dict['tau'])
+
+        cov_pick = prior_cov_mat @ np.swapaxes(view_pick_mat, -1, -2) # (..., n, k)
+        pick_cov_pick = view_pick_mat @ cov_pick # (..., k, k)
+        if diagnal:
+            view_total_cov = pick_cov_pick + cls.view_var_mat_diag(view_pick_mat, prior_cov_mat, pick_cov_pick=pick_cov_pick)
+        else:
+            view_total_cov = 2.0 * pick_cov_pick
+
+        residual = view_rtn_vec - np.einsum('...kn,...n->...k', view_pick_mat, prior_rtn_vec)
+        posterior_rtn_vec = prior_rtn_vec + \
+            np.einsum('...nk,...k->...n', cov_pick, np.linalg.solve(view_total_cov, residual[..., None])[..., 0])
+        if not return_cov:
+            return posterior_rtn_vec
+        posterior_cov_mat = prior_cov_mat - cov_pick @ np.linalg.solve(view_total_cov, np.swapaxes(cov_pick, -1, -2))
+        return posterior_rtn_vec, posterior_cov_mat
+
     @staticmethod
     def EXPE_return_BL(prior_precs_mat:np.ndarray, prior_rtn_vec:np.ndarray, view_pick_mat:np.ndarray, view_precs_mat:np.ndarray, view_rtn_vec:np.ndarray):
         return np.linalg.inv( prior_precs_mat + view_pick_mat.T@view_precs_mat@view_pick_mat ) @ (prior_precs_mat @ prior_rtn_vec + view_pick_mat.T@view_precs_mat@view_rtn_vec)
@@ -112,11 +176,14 @@ class BlackLitterman:
         return tau * hist_cov_mat
     
     @staticmethod
-    def view_var_mat_diag(view_pick_mat:np.ndarray, prior_asset_cov_mat:np.ndarray, diagnal=True):
+    def view_var_mat_diag(view_pick_mat:np.ndarray, prior_asset_cov_mat:np.ndarray, diagnal=True, pick_cov_pick=None):
+        # 支持前置批量维度. pick_cov_pick: 已算好的 P @ Phi0 @ P', 可省去重复计算
+        if pick_cov_pick is None:
+            pick_cov_pick = view_pick_mat @ prior_asset_cov_mat @ np.swapaxes(view_pick_mat, -1, -2)
         if diagnal:
-            return np.diag( np.diag( view_pick_mat @ prior_asset_cov_mat @ view_pick_mat.T ) )
+            return np.einsum('...kk->...k', pick_cov_pick)[..., None] * np.eye(pick_cov_pick.shape[-1])
         else:
-            return view_pick_mat @ prior_asset_cov_mat @ view_pick_mat.T
+            return pick_cov_pick
     
     @staticmethod
     def view_pick_mat_row_orthog_check(view_pick_mat:np.ndarray):
@@ -132,6 +199,114 @@ class BlackLitterman:
 
 
 
+# 滚动回测中的预期收益率: BL 后验
+class blackLittermanRtnProvider:
+    '''
+    expected-return provider for rolling strategies (e.g. meanvarOptStrat).
+    interface: provider(position_no, train_rtn_mat, cov_mat=None, panel_key=None) -> expected return vector,
+    position_no starts from 1.
+
+    The prior of each window comes from its own covariance (equilibrium return
+    risk_avers_factor * cov_mat @ equi_wght_vec, prior covariance tau * cov_mat), the posterior uses the
+    woodbury form of BlackLitterman. Views are normalized once for all windows.
+    Posteriors are memoized by (panel_key, position_no, view set), so drilling down into one window
+    (e.g. detail_window) or switching back to an old view set does not recompute.
+    panel_key is given by the caller and must identify the data of the windows (e.g. assets, date range,
+    window, stride and covariance estimator), so reusing the provider on other data never returns a stale
+    posterior. Without panel_key nothing is memoized.
+    At most max_cache_size posteriors are kept, the oldest are dropped first.
+    The prior of the latest window is kept, so several view sets on the same window share it.
+    '''
+
+    __slots__ = ("__view_pick_mat", "__view_rtn_vec", "__view_key", "__risk_avers_factor", "__equi_wght_vec",
+                 "__tau", "__diagnal", "__prior_key", "__prior", "__posterior_cache", "__max_cache_size")
+
+
+    def __init__(
+            self,
+            view_pick_mat: np.ndarray,
+            view_rtn_vec: np.ndarray,
+            risk_avers_factor: float,
+            equi_wght_vec: np.ndarray = None,
+            tau: float = 0.05,
+            normalize: bool = False,
+            diagnal: bool = True,
+            max_cache_size: int = 4096
+            ) -> None:
+        # equi_wght_vec 不输入时用等权作为均衡组合
+        self.__risk_avers_factor, self.__equi_wght_vec = risk_avers_factor, equi_wght_vec
+        self.__tau, self.__diagnal = tau, diagnal
+        self.__prior_key, self.__prior = None, None
+        self.__posterior_cache = {}
+        self.__max_cache_size = max_cache_size
+        self.set_views(view_pick_mat, view_rtn_vec, normalize)
+
+
+    def set_views(
+            self,
+            view_pick_mat: np.ndarray,
+            view_rtn_vec: np.ndarray,
+            normalize: bool = False
+            ) -> None:
+        view_pick_mat = np.asarray(view_pick_mat, dtype=np.float64)
+        view_rtn_vec = np.asarray(view_rtn_vec, dtype=np.float64)
+        if normalize:
+            scale = np.sqrt( np.diag( view_pick_mat @ view_pick_mat.T ) )
+            view_pick_mat, view_rtn_vec = scale[:, None] * view_pick_mat, scale * view_rtn_vec
+
+        self.__view_pick_mat, self.__view_rtn_vec = view_pick_mat, view_rtn_vec
+        self.__view_key = (view_pick_mat.shape, view_pick_mat.tobytes(), view_rtn_vec.tobytes())
+
+
+    @property
+    def cache_size(self) -> int:
+        return len(self.__posterior_cache)
+
+
+    def clear_cache(self) -> None:
+        self.__posterior_cache.clear()
+        self.__prior_key, self.__prior = None, None
+
+
+    def __call__(
+            self,
+            position_no: int,
+            train_rtn_mat: np.ndarray,
+            cov_mat: np.ndarray = None,
+            panel_key: t.Hashable = None
+            ) -> np.ndarray:
+        # 没有 panel_key 时无法确认窗口数据是否相同, 不缓存
+        key = None if panel_key is None else (panel_key, position_no, self.__view_key)
+        if key is not None and key in self.__posterior_cache:
+            return self.__posterior_cache[key]
+
+        if key is None or self.__prior_key != key[:2]:
+            if cov_mat is None:
+                cov_mat = np.cov(train_rtn_mat)
+            num_assets = cov_mat.shape[0]
+            equi_wght_vec = np.full(num_assets, 1.0/num_assets) if self.__equi_wght_vec is None else self.__equi_wght_vec
+            self.__prior = (BlackLitterman.equi_rtn_vec(self.__risk_avers_factor, cov_mat, equi_wght_vec),
+                            BlackLitterman.prior_cov_mat_shrink(cov_mat, self.__tau))
+            self.__prior_key = None if key is None else key[:2]
+
+        prior_rtn_vec, prior_cov_mat = self.__prior
+        view_var_mat = BlackLitterman.view_var_mat_diag(self.__view_pick_mat, prior_cov_mat, self.__diagnal)
+        posterior_rtn_vec = BlackLitterman.EXPE_return_BL_woodbury(
+            prior_cov_mat, prior_rtn_vec, self.__view_pick_mat, view_var_mat, self.__view_rtn_vec
+            )
+
+        if key is None:
+            return posterior_rtn_vec
+
+        self.__posterior_cache[key] = posterior_rtn_vec
+        while len(self.__posterior_cache) > self.__max_cache_size:
+            self.__posterior_cache.pop(next(iter(self.__posterior_cache)))
+
+        return posterior_rtn_vec
+
+
+
+
 
 
 
@@ -0,0 +1,361 @@
+import numpy as np
+import scipy.linalg as scipylinalg
+import typing as t
+
+
+# 相对主元 pivot / V_ii 不大于该值时, 认为资产与其他资产共线
+_PIVOT_RTOL = 1e-8
+
+
+
+
+class covFactorization:
+    '''
+    Factorize a covariance matrix once, then reuse the factor for every
+    solve / log-det on it.
+
+    Cholesky  V = L @ L.T  is tried first. If it fails (V not numerically
+    positive definite), fall back to LDL.T with Bunch-Kaufman pivoting.
+
+    pivots: conditional variance of each asset given the previous assets,
+    i.e. diag(L)^2 for Cholesky or diag(D) for LDL.T. Relative pivot
+    pivot / V_ii = 1 - R^2 of the asset regressed on the previous assets,
+    so a near-zero relative pivot means the asset is (almost) a linear
+    combination of others.
+
+    attributes:
+        1. method: 'cholesky' or 'ldl'
+        2. pivots
+        3. singular_idx
+    methods:
+        1. solve(b)  V^{-1} @ b, b with shape (n,) or (n, k)
+        2. logdet
+    '''
+
+    __slots__ = ("__method", "__num", "__cho", "__ldl_lu", "__ldl_d_band",
+                 "__ldl_perm", "__pivots", "__indefinite", "__singular_idx")
+
+
+    def __init__(
+            self,
+            cov_mat: np.ndarray,
+            pivot_rtol: float = _PIVOT_RTOL
+            ) -> None:
+
+        cov_mat = np.asarray(cov_mat, dtype=np.float64)
+        self.__num = cov_mat.shape[0]
+        self.__indefinite = False
+
+        try:
+            self.__cho = scipylinalg.cho_factor(cov_mat, lower=True, check_finite=False)
+            self.__method = 'cholesky'
+            self.__pivots = np.square( np.diag(self.__cho[0]) )
+
+        except np.linalg.LinAlgError:
+            # 非正定时, 用 LDL.T 分解
+            lu, d, perm = scipylinalg.ldl(cov_mat, lower=True, check_finite=False)
+            self.__method = 'ldl'
+            self.__ldl_lu, self.__ldl_perm = lu, perm
+            # d 是块对角(1x1 或 2x2 块)的三对角矩阵, 按 banded 格式保存
+            self.__ldl_d_band = np.stack(
+                [np.concatenate([[0.], np.diag(d, 1)]),
+                 np.diag(d),
+                 np.concatenate([np.diag(d, -1), [0.]])],
+                axis=0
+                )
+            # 第 j 步的主元对应资产 perm[j]
+            self.__pivots = np.empty(self.__num)
+            self.__pivots[perm] = np.diag(d)
+            # 出现 2x2 块说明矩阵不定, 不可能是协方差矩阵
+            self.__indefinite = bool( np.any(np.diag(d, 1) != 0) )
+
+        scale = np.diag(cov_mat)
+        rel_pivots = np.divide(self.__pivots, scale,
+                               out=np.zeros_like(self.__pivots), where=scale > 0)
+        self.__singular_idx = np.where(rel_pivots <= pivot_rtol)[0]
+
+
+    @property
+    def method(self) -> str:
+        return self.__method
+
+
+    @property
+    def pivots(self) -> np.ndarray:
+        return self.__pivots
+
+
+    @property
+    def singular_idx(self) -> np.ndarray:
+        # 与之前资产(近似)线性相关的资产位置
+        return self.__singular_idx
+
+
+    @property
+    def lower_factor(self) -> np.ndarray:
+        '''
+        lower triangular(up to permutation) F with V = F @ F.T
+        '''
+        if self.__method == 'cholesky':
+            return np.tril(self.__cho[0])
+
+        assert not self.__indefinite and (self.__pivots >= 0).all(), \
+            'indefinite matrix has no real factor F with V = F @ F.T'
+        # V = L @ D @ L.T, D 为非负对角, F = L @ sqrt(D)
+        return self.__ldl_lu * np.sqrt(self.__ldl_d_band[1])
+
+
+    @property
+    def is_singular(self) -> bool:
+        return self.__indefinite or len(self.__singular_idx) > 0
+
+
+    def solve(
+            self,
+            b: np.ndarray
+            ) -> np.ndarray:
+        '''
+        return V^{-1} @ b without forming V^{-1}
+        '''
+        if self.__method == 'cholesky':
+            return scipylinalg.cho_solve(self.__cho, b, check_finite=False)
+
+        # V = L @ D @ L.T, 其中 L[perm] 是单位下三角
+        perm = self.__ldl_perm
+        tri_l = self.__ldl_lu[perm]
+        # L @ y = b
+        y = scipylinalg.solve_triangular(tri_l, b[perm], lower=True,
+                                         unit_diagonal=True, check_finite=False)
+        # D @ z = y
+        z = scipylinalg.solve_banded((1, 1), self.__ldl_d_band, y, check_finite=False)
+        # L.T @ x = z
+        x = np.empty_like(z)
+        x[perm] = scipylinalg.solve_triangular(tri_l.T, z, lower=False,
+                                               unit_diagonal=True, check_finite=False)
+        return x
+
+
+    @property
+    def logdet(self) -> np.floating:
+        '''
+        log(det(V)). -inf/nan if V is singular or indefinite
+        '''
+        if self.__method == 'cholesky':
+            return 2.0 * np.sum( np.log( np.diag(self.__cho[0]) ) )
+
+        if self.__indefinite:
+            return np.nan
+
+        return np.sum( np.log(self.__pivots) )
+
+
+
+
+
+class factorCovariance:
+    '''
+    Structured covariance of a factor model
+        V = B @ F @ B.T + diag(d)
+    B: loadings, shape (n, k); F: factor covariance, shape (k, k); d: specific variance, shape (n,)
+
+    With F = L_F @ L_F.T and the scaled loadings Bs = B @ L_F, V = Bs @ Bs.T + diag(d).
+    V is never formed: V @ x costs O(nk), V^{-1} @ b costs O(nk) by the Woodbury identity
+        V^{-1} = D^{-1} - D^{-1} @ Bs @ C^{-1} @ Bs.T @ D^{-1},  C = I + Bs.T @ D^{-1} @ Bs (k x k)
+
+    Supports `V @ x` and `x @ V` like a dense matrix, and has the same solve / logdet /
+    singular_idx / is_singular interface as covFactorization.
+
+    attributes:
+        1. scaled_loadings: Bs
+        2. specific_var: d
+        3. shape
+    methods:
+        1. solve(b)  V^{-1} @ b
+        2. diagonal()
+        3. to_dense()
+    '''
+
+    __slots__ = ("__scaled_loadings", "__specific_var", "__num", "__capacitance", "__singular_idx")
+
+    # 让 ndarray @ factorCovariance 交给 __rmatmul__ 处理
+    __array_ufunc__ = None
+
+
+    def __init__(
+            self,
+            loadings: np.ndarray,
+            factor_cov: np.ndarray,
+            specific_var: np.ndarray,
+            pivot_rtol: float = _PIVOT_RTOL
+            ) -> None:
+
+        loadings = np.asarray(loadings, dtype=np.float64)
+        specific_var = np.asarray(specific_var, dtype=np.float64)
+
+        assert loadings.shape[0] == len(specific_var), \
+            "Assets number conflicts between loadings & specific variance"
+
+        self.__num = len(specific_var)
+        # F 可能只是半正定, 用 covFactorization 的分解因子
+        self.__scaled_loadings = loadings @ covFactorization(factor_cov).lower_factor
+        self.__specific_var = specific_var
+
+        # 特质方差相对总方差接近0的资产, 与因子(及其他资产)近似共线
+        scale = self.diagonal()
+        rel_pivots = np.divide(specific_var, scale, out=np.zeros_like(specific_var), where=scale > 0)
+        self.__singular_idx = np.where(rel_pivots <= pivot_rtol)[0]
+
+        if len(self.__singular_idx) == 0:
+            scaled_by_d = self.__scaled_loadings / specific_var[:, None]
+            self.__capacitance = scipylinalg.cho_factor(
+                np.eye(self.__scaled_loadings.shape[1]) + self.__scaled_loadings.T @ scaled_by_d,
+                lower=True, check_finite=False
+                )
+        else:
+            self.__capacitance = None
+
+
+    @property
+    def shape(self) -> t.Tuple[int, int]:
+        return (self.__num, self.__num)
+
+    @property
+    def method(self) -> str:
+        return 'woodbury'
+
+    @property
+    def scaled_loadings(self) -> np.ndarray:
+        return self.__scaled_loadings
+
+    @property
+    def specific_var(self) -> np.ndarray:
+        return self.__specific_var
+
+    @property
+    def singular_idx(self) -> np.ndarray:
+        return self.__singular_idx
+
+    @property
+    def is_singular(self) -> bool:
+        return len(self.__singular_idx) > 0
+
+
+    def __matmul__(self, x: np.ndarray) -> np.ndarray:
+        # x with shape (n,) or (n, m)
+        d = self.__specific_var if x.ndim == 1 else self.__specific_var[:, None]
+        return self.__scaled_loadings @ (self.__scaled_loadings.T @ x) + d * x
+
+
+    def __rmatmul__(self, x: np.ndarray) -> np.ndarray:
+        # V 对称, x @ V = (V @ x.T).T
+        return (self @ x.T).T
+
+
+    def diagonal(self) -> np.ndarray:
+        return np.square(self.__scaled_loadings).sum(axis=1) + self.__specific_var
+
+
+    def to_dense(self) -> np.ndarray:
+        # O(n^2) 内存, 只用于不支持结构化协方差的场合
+        return self.__scaled_loadings @ self.__scaled_loadings.T + np.diag(self.__specific_var)
+
+
+    def solve(
+            self,
+            b: np.ndarray
+            ) -> np.ndarray:
+        '''
+        return V^{-1} @ b by the Woodbury identity, O(nk) per column
+        '''
+        assert self.__capacitance is not None, \
+            'singular factor covariance has no inverse'
+
+        d = self.__specific_var if b.ndim == 1 else self.__specific_var[:, None]
+        b_scaled = b / d
+        correction = scipylinalg.cho_solve(self.__capacitance, self.__scaled_loadings.T @ b_scaled,
+                                           check_finite=False)
+        return b_scaled - (self.__scaled_loadings @ correction) / d
+
+
+    @property
+    def logdet(self) -> np.floating:
+        '''
+        log(det(V)) = log(det(D)) + log(det(C)). -inf if V is singular
+        '''
+        if self.__capacitance is None:
+            return -np.inf
+
+        return np.sum( np.log(self.__specific_var) ) + \
+            2.0 * np.sum( np.log( np.diag(self.__capacitance[0]) ) )
+
+
+
+
+
+def _batch_cholesky(
+        cov_stack: np.ndarray
+        ) -> t.Tuple[np.ndarray, np.ndarray]:
+    '''
+    batched Cholesky of cov_stack (num_windows, n, n)
+    return:
+        lower_stack: shape (num_windows, n, n), nan for windows that are not positive definite
+        pd_mask: shape (num_windows, ), True if the Cholesky of window w succeeded
+    np.linalg.cholesky fails the whole stack if one window fails; the stack is then split in halves
+    and retried, so k failed windows cost O(k log W) batched calls instead of one call per window.
+    '''
+    try:
+        return np.linalg.cholesky(cov_stack), np.ones(len(cov_stack), dtype=bool)
+    except np.linalg.LinAlgError:
+        if len(cov_stack) == 1:
+            return np.full(cov_stack.shape, np.nan), np.zeros(1, dtype=bool)
+
+    half = len(cov_stack) // 2
+    lower_head, mask_head = _batch_cholesky(cov_stack[:half])
+    lower_tail, mask_tail = _batch_cholesky(cov_stack[half:])
+
+    return np.concatenate([lower_head, lower_tail], axis=0), np.concatenate([mask_head, mask_tail])
+
+
+
+
+def batch_cov_solve(
+        cov_stack: np.ndarray,
+        rhs_stack: np.ndarray,
+        pivot_rtol: float = _PIVOT_RTOL
+        ) -> t.Tuple[np.ndarray, np.ndarray]:
+    '''
+    cov_stack: shape (num_windows, n, n)
+    rhs_stack: shape (num_windows, n, k)
+    return:
+        solution: shape (num_windows, n, k), V_w^{-1} @ rhs_w of every window w.
+            rows of singular windows are nan
+        singular_mask: shape (num_windows, ), True if window w is (near) singular
+    Singularity is judged the same way as covFactorization: from the relative
+    pivots of a batched Cholesky. All non-singular windows are then solved with one
+    stacked np.linalg.solve. Only windows that are not positive definite (batched
+    Cholesky fails on them) are factorized one by one with covFactorization.
+    '''
+    # 取数得到的收益率是 float32, 奇异判断(pivot_rtol)与求解都必须在 float64 下进行
+    cov_stack = np.asarray(cov_stack, dtype=np.float64)
+    rhs_stack = np.asarray(rhs_stack, dtype=np.float64)
+    scale = np.diagonal(cov_stack, axis1=1, axis2=2)
+    solution = np.full(rhs_stack.shape, np.nan)
+
+    lower_stack, pd_mask = _batch_cholesky(cov_stack)
+    pivots = np.square( np.diagonal(lower_stack, axis1=1, axis2=2) )
+    rel_pivots = np.divide(pivots, scale, out=np.zeros_like(pivots), where=scale > 0)
+    singular_mask = (rel_pivots <= pivot_rtol).any(axis=1) | ~pd_mask
+
+    # 非奇异窗口一次堆叠求解
+    solvable = ~singular_mask
+    if solvable.any():
+        solution[solvable] = np.linalg.solve(cov_stack[solvable], rhs_stack[solvable])
+
+    # 非正定窗口逐个用 LDL.T 分解判断
+    for w in np.where(~pd_mask)[0]:
+        factor = covFactorization(cov_stack[w], pivot_rtol)
+        singular_mask[w] = factor.is_singular
+        if not factor.is_singular:
+            solution[w] = factor.solve(rhs_stack[w])
+
+    return solution, singular_mask
@@ -1,4 +1,5 @@
 from typing import TypedDict
+import typing as t
 import numpy as np
 
 
@@ -12,6 +13,30 @@ class basicPortfSolveRes(TypedDict):
     portf_var: np.floating
     solve_status: str
     assets_idlst: list
+    qp_iterations: int
+
+
+
+
+
+class frontierPortfSolveRes(TypedDict):
+    portf_w: np.ndarray # shape (num_targets, num_assets)
+    portf_rtn: np.ndarray # shape (num_targets, )
+    portf_var: np.ndarray # shape (num_targets, )
+    solve_status: t.List[str]
+    assets_idlst: list
+
+
+
+
+
+class riskParitySolveRes(TypedDict):
+    portf_w: np.ndarray
+    portf_rtn: np.floating
+    portf_var: np.floating
+    risk_contribs: np.ndarray # shape (num_assets, ) or (num_categories, )
+    solve_status: str
+    assets_idlst: list
 
 
 
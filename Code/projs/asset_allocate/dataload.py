@@ -137,30 +137,22 @@ def db_date_data(
 
 
 
-# get data for train and backtest
-def get_train_hold_rtn_data(
+# load returns from begindate - back_window_size to termidate
+def _get_rtn_panel(
         begindate: str,
         termidate: str,
-        gapday: int,
         back_window_size: int,
         dilate: int,
         assets_ids: t.Union[t.List[str], t.List[list]],
         tbl_names: t.Union[str, t.List[str]],
         db_info: dict,
         mkt_date_tbl: str
-        ) -> t.Tuple[t.List[np.ndarray], t.List[np.ndarray], list]:
+        ) -> t.Tuple[np.ndarray, int, list]:
     '''
-    assets_ids & tbl_names:
-    1. if all assets come from 1 table, then arg {tbl_names} is the string of the table,
-        assets_ids is a list of asset id codes
-
-        e.g, assets_ids = ['000001.SH', '000002.SH'], tbl_names = 'aidx_eod_prices'
-    2. if assets come from multiple tables, then arg {tbl_names} is the string of tables,
-        assets_ids is a list of lists of asset id code 
-        which come from corresponding table name by order.
-
-        e.g, assets_ids = [['000001.SH', '000002.SH'], ['CBA0001.CBI']],
-        tbl_names = ['aidx_eod_prices', 'cbidx_eod_prices']
+    return:
+        all_rtn_data: (num_assets, back_window_size + num_period_days_from_begin_to_termi)
+        begindate_idx: column of begindate in all_rtn_data, equals back_window_size
+        assets_idlst
     '''
     # 取数据，一次io解决
     # 取出2000-01-01至终止日, 所有的交易日期，已排序
@@ -210,10 +202,17 @@ def get_train_hold_rtn_data(
         f'market dates with length {len(all_mkt_dates)} \
           and Index return dates {all_rtn_data.shape[1]} mismatch'
     
-    # 从 all_rtn_data 中，取出 begindate到termidate的列
-    rtn_data = all_rtn_data[:, begindate_idx:]
+    return all_rtn_data, begindate_idx, assets_idlst
+
+
+
+
+# 每一期持仓起始，往后持仓gapday天或最后一天
+def _get_hold_rtn_mat_list(
+        rtn_data: np.ndarray,
+        gapday: int
+        ) -> t.List[np.ndarray]:
 
-    # 每一期持仓起始，往后持仓gapday天或最后一天
     strided_slices, _, last_range = strided_slicing_w_residual(
         rtn_data.shape[1],
         gapday,
@@ -224,6 +223,50 @@ def get_train_hold_rtn_data(
 
     if list(last_range): # rsd_range不为空
         hold_rtn_mat_list.append( rtn_data.T[last_range].T )
+
+    return hold_rtn_mat_list
+
+
+
+
+# get data for train and backtest
+def get_train_hold_rtn_data(
+        begindate: str,
+        termidate: str,
+        gapday: int,
+        back_window_size: int,
+        dilate: int,
+        assets_ids: t.Union[t.List[str], t.List[list]],
+        tbl_names: t.Union[str, t.List[str]],
+        db_info: dict,
+        mkt_date_tbl: str
+        ) -> t.Tuple[t.List[np.ndarray], t.List[np.ndarray], list]:
+    '''
+    assets_ids & tbl_names:
+    1. if all assets come from 1 table, then arg {tbl_names} is the string of the table,
+        assets_ids is a list of asset id codes
+
+        e.g, assets_ids = ['000001.SH', '000002.SH'], tbl_names = 'aidx_eod_prices'
+    2. if assets come from multiple tables, then arg {tbl_names} is the string of tables,
+        assets_ids is a list of lists of asset id code 
+        which come from corresponding table name by order.
+
+        e.g, assets_ids = [['000001.SH', '000002.SH'], ['CBA0001.CBI']],
+        tbl_names = ['aidx_eod_prices', 'cbidx_eod_prices']
+    '''
+    all_rtn_data, begindate_idx, assets_idlst = _get_rtn_panel(
+        begindate,
+        termidate,
+        back_window_size,
+        dilate,
+        assets_ids,
+        tbl_names,
+        db_info,
+        mkt_date_tbl
+        )
+    
+    # 从 all_rtn_data 中，取出 begindate到termidate的列
+    hold_rtn_mat_list = _get_hold_rtn_mat_list(all_rtn_data[:, begindate_idx:], gapday)
     
     # 每一期调仓日期起始，往前回溯back_window_size天。调仓日期在持仓日之前
     strided_slices, _, _ = strided_slicing_w_residual(
@@ -242,6 +285,48 @@ def get_train_hold_rtn_data(
 
 
 
+# get data for streaming estimators (e.g. ewmaCovariance) and backtest
+def get_panel_hold_rtn_data(
+        begindate: str,
+        termidate: str,
+        gapday: int,
+        back_window_size: int,
+        dilate: int,
+        assets_ids: t.Union[t.List[str], t.List[list]],
+        tbl_names: t.Union[str, t.List[str]],
+        db_info: dict,
+        mkt_date_tbl: str
+        ) -> t.Tuple[np.ndarray, np.ndarray, t.List[np.ndarray], list]:
+    '''
+    same inputs as get_train_hold_rtn_data, but the overlapping train windows are not sliced out.
+    return:
+        all_rtn_data: (num_assets, back_window_size + num_period_days_from_begin_to_termi)
+        rebal_idx: column of every rebalance day in all_rtn_data. train window i of get_train_hold_rtn_data
+            is all_rtn_data[:, rebal_idx[i]-back_window_size : rebal_idx[i]]
+        hold_rtn_mat_list
+        assets_idlst
+    '''
+    all_rtn_data, begindate_idx, assets_idlst = _get_rtn_panel(
+        begindate,
+        termidate,
+        back_window_size,
+        dilate,
+        assets_ids,
+        tbl_names,
+        db_info,
+        mkt_date_tbl
+        )
+
+    hold_rtn_mat_list = _get_hold_rtn_mat_list(all_rtn_data[:, begindate_idx:], gapday)
+
+    # 调仓日 = 各持仓期的第一天, 在调仓日早上用之前的数据估计
+    rebal_idx = begindate_idx + gapday * np.arange(len(hold_rtn_mat_list))
+
+    return all_rtn_data, rebal_idx, hold_rtn_mat_list, assets_idlst
+
+
+
+
 # get data for train and backtest
 def get_benchmark_rtn_data(
         begindate: str,
@@ -92,6 +92,113 @@ def get_constraints(
 
 
 
+def get_group_constraints(
+        assets_dict: dict,
+        assets_idlst: list,
+        group_info_lst: t.Union[t.List[dict], None]
+        ) -> t.Union[list, None]:
+    '''
+    input:
+        1. assets_dict,  {'id': {'categ':, 'l_b', 'u_b'} }
+        2. assets_idlst, [ 'id1', 'id2', 'id3',... ]
+        3. group_info_lst, list of {'category':, 'lower_bound':, 'upper_bound':}
+            or {'assets': ['id1', 'id2'], 'lower_bound':, 'upper_bound':}
+            the former limits total weight of all assets with this category,
+            the latter limits total weight of any group of assets (groups can overlap)
+
+    return:
+        [member_lst, low_bounds, upper_bounds] or None
+        member_lst: list of np.ndarray, positions of group members in assets_idlst
+        low_bounds, upper_bounds: np.ndarray, nan if the bound is not given
+    '''
+    if not group_info_lst:
+        return None
+
+    member_lst, low_bounds, upper_bounds = [], [], []
+
+    for group in group_info_lst:
+        if 'category' in group:
+            members = [i for i, asset_id in enumerate(assets_idlst)
+                       if assets_dict[asset_id]['categ'] == group['category']]
+        else:
+            members = [assets_idlst.index(asset_id) for asset_id in group['assets']
+                       if asset_id in assets_idlst]
+
+        # 组内没有资产时忽略
+        if not members:
+            continue
+
+        member_lst.append( np.array(members) )
+
+        # 如果输入为空字符串, 该方向无约束
+        try:
+            low_bounds.append( float(group.get('lower_bound')) )
+        except (ValueError, TypeError):
+            low_bounds.append( np.nan )
+
+        try:
+            upper_bounds.append( float(group.get('upper_bound')) )
+        except (ValueError, TypeError):
+            upper_bounds.append( np.nan )
+
+    if not member_lst:
+        return None
+
+    low_bounds, upper_bounds = np.array(low_bounds), np.array(upper_bounds)
+
+    assert not any(low_bounds > upper_bounds), \
+        "all group low bounds must be be smaller or equal to group high bounds"
+
+    return [member_lst, low_bounds, upper_bounds]
+
+
+
+
+def get_bl_params(
+        assets_dict: dict,
+        assets_idlst: list,
+        inputs: dict
+        ) -> t.Union[dict, None]:
+    '''
+    input:
+        1. assets_dict,  {'id': {'categ':, 'l_b', 'u_b'} }, 其 key 的顺序即 assets_info 的输入顺序
+        2. assets_idlst, [ 'id1', 'id2', 'id3',... ], 取数之后资产的排列
+        3. inputs, 其中 BlackLitterman 观点相关的字段:
+            view_pick_mat: k 行观点, 每行按 assets_info 的资产顺序
+            view_rtn_vec: k 个观点收益率
+            risk_avers_factor, tau(可选, 默认0.05), equi_wght_vec(可选, 按 assets_info 顺序, 默认等权)
+
+    return:
+        {'view_pick_mat', 'view_rtn_vec', 'risk_avers_factor', 'equi_wght_vec', 'tau'} 按 assets_idlst 排列,
+        或 None(没有输入观点)
+    '''
+    if not inputs.get('view_pick_mat'):
+        return None
+
+    input_ids = list(assets_dict.keys())
+    cols = [input_ids.index(asset_id) for asset_id in assets_idlst]
+
+    view_pick_mat = np.array(inputs['view_pick_mat'], dtype=np.float64)
+    view_rtn_vec = np.array(inputs['view_rtn_vec'], dtype=np.float64)
+
+    assert view_pick_mat.shape == (len(view_rtn_vec), len(input_ids)), \
+        "view_pick_mat must have one row per view and one column per asset of assets_info"
+
+    equi_wght_vec = inputs.get('equi_wght_vec')
+    if equi_wght_vec is not None:
+        equi_wght_vec = np.array(equi_wght_vec, dtype=np.float64)[cols]
+
+    return {
+        'view_pick_mat': view_pick_mat[:, cols],
+        'view_rtn_vec': view_rtn_vec,
+        'risk_avers_factor': float(inputs['risk_avers_factor']),
+        'equi_wght_vec': equi_wght_vec,
+        'tau': float(inputs.get('tau', 0.05))
+    }
+
+
+
+
 def get_tbl_asset(asset_id:str, *args, **kwargs) -> str:
     return "aidx_eod_prices"
 
@@ -5,8 +5,10 @@ from typing import Any
 from operator import itemgetter
 
 from Code.Allocator.MeanVarOptimal import MeanVarOpt
+from Code.Forecaster.BlackLitterman import blackLittermanRtnProvider
+from Code.Estimator.Risks import get_cov_estimator
 from Code.projs.asset_allocate.dataLoad import (
-    get_train_hold_rtn_data, 
+    get_panel_hold_rtn_data,
     _DB,
     _MKT_DATE_TABLE
     )
@@ -16,7 +18,9 @@ from Code.BackTester.BT_AssetAllocate import (
 from Code.projs.asset_allocate.runner import *
 from Code.projs.asset_allocate.inputParser import (
     parseAssets2dicts,
-    get_constraints
+    get_constraints,
+    get_group_constraints,
+    get_bl_params
     )
 from Code.Utils.Decorator import (
     tagFunc,
@@ -26,6 +30,10 @@ from Code.Utils.Decorator import (
     )
 
 
+# 视为求解成功的状态: 采用求得的权重, 并可作为下一窗口的热启动
+_SOLVED_STATUS = ('direct', 'direct_feasible', 'qp_optimal', 'socp_optimal', 'box_optimal', 'cla_optimal')
+
+
 
 
 class meanvarOptStrat:
@@ -38,22 +46,41 @@ class meanvarOptStrat:
     
     methods:
         1. backtest()  get backtest result
+
+    rtn_provider: expected-return provider, provider(position_no, train_rtn_mat, cov_mat, panel_key) -> rtn_rates.
+        panel_key 标识窗口数据(面板与协方差估计器), provider 可据此缓存.
+        不输入时, 若 inputs 给出了 BlackLitterman 观点(view_pick_mat 等), 用 BL 后验; 否则用样本均值.
+        BL provider 在第一次取数后构建一次, 后验缓存在 backtest 与 detail_window 间共用
+    inputs['cov_estimator']: 各窗口均值/协方差的估计器名称, 见 Code.Estimator.Risks.COV_ESTIMATORS:
+        'sample'(默认), 'ledoit_wolf', 'oas', 'ewma' 或 'pca_factor'
+    inputs['cov_estimator_params']: 可选, 估计器参数, 如 {"halflife": 20}, {"num_factors": 5}
+        估计器直接在取数得到的整段面板上按调仓日估计, 不切出重叠的训练窗口(ewma 逐日消费面板).
+        估计结果按 (面板, 窗口位置, 估计器参数) 缓存, 相同资产池/区间的多次回测不重复估计
     '''
 
 
-    __slots__ = ("__inputs", "__assets_idlst", "__flag",  "__portf_w_list", "__detail_solve_results")
+    __slots__ = ("__inputs", "__assets_idlst", "__flag",  "__portf_w_list", "__detail_solve_results",
+                 "__qp_backend", "__rtn_provider", "__cov_estimator")
 
 
 
     def __init__(self,
-                 inputs: Any
+                 inputs: Any,
+                 rtn_provider: t.Union[t.Callable, None] = None
                  ) -> None:
         
         self.__inputs = inputs
+        self.__rtn_provider = rtn_provider
         self.__assets_idlst = []
         self.__portf_w_list = []
         self.__detail_solve_results = []
         self.__flag = ''
+        # 有上下限约束时的求解器: 'cvxopt', 'box' 或 'cla'
+        self.__qp_backend = inputs.get('qp_backend', 'cvxopt')
+        # 协方差估计器, 名称或参数不合法时抛出 ValueError
+        self.__cov_estimator = get_cov_estimator(
+            inputs.get('cov_estimator', 'sample'), inputs.get('cov_estimator_params')
+            )
         
 
 
@@ -72,8 +99,13 @@ class meanvarOptStrat:
             'annual_rtn': np.floating
         '''
 
-        train_rtn_mat_list, hold_rtn_mat_list, self.__assets_idlst, constraints, self.__flag,\
-            expt_tgt_value = self._get_meanvar_data_params()
+        rtn_data, rebal_idx, panel_key, hold_rtn_mat_list, self.__assets_idlst, constraints, self.__flag,\
+            expt_tgt_value, group_constraints = self._get_meanvar_data_params()
+        self.__build_rtn_provider(self.__assets_idlst)
+        # 窗口数据由面板与协方差估计器确定, 作为预期收益率 provider 的缓存 key
+        rtn_key = (panel_key, self.__cov_estimator.key)
+        # 各调仓日的训练窗口是面板上的视图, 不复制重叠部分
+        train_rtn_mat_list = [rtn_data[:, idx-back_window_size:idx] for idx in rebal_idx]
         
         num_assets = len(self.__assets_idlst)
 
@@ -81,18 +113,41 @@ class meanvarOptStrat:
         self.__portf_w_list, self.__detail_solve_results = \
             [np.repeat(1/num_assets, num_assets), ], []
 
-        for i, train_rtn_mat in enumerate(train_rtn_mat_list):
+        # 所有窗口的 (均值, 协方差) 一次估计, 结果在估计器中缓存
+        window_moments = self.__cov_estimator(rtn_data, rebal_idx, back_window_size, panel_key)
+        dense_cov = all(isinstance(cov_mat, np.ndarray) for _, cov_mat in window_moments)
 
-            cur_res = self.__solve_single_mvopt(
-                train_rtn_mat,
+        if constraints[0] is None and constraints[1] is None and group_constraints is None and \
+            self.__flag in ('minWave', 'maxReturn', 'sharp') and dense_cov:
+            # 无上下限约束时是闭式解, 所有窗口一次性批量求解. 因子模型协方差逐窗口用 Woodbury 求解
+            solve_res_list = self.__solve_batch_mvopt(
+                np.stack(train_rtn_mat_list, axis=0),
+                self.__assets_idlst,
+                self.__flag,
+                expt_tgt_value,
+                self.__rtn_provider,
+                window_moments,
+                rtn_key
+                )
+        else:
+            solve_res_list = self.__solve_rolling_mvopt(
+                train_rtn_mat_list,
                 self.__assets_idlst,
                 constraints,
                 self.__flag,
-                expt_tgt_value
+                expt_tgt_value,
+                self.__qp_backend,
+                group_constraints,
+                self.__rtn_provider,
+                window_moments,
+                rtn_key
                 )
+
+        for i, cur_res in enumerate(solve_res_list):
+
             cur_res['position_no'] = i + 1
 
-            if cur_res['solve_status'] in ('direct', 'qp_optimal'):
+            if cur_res['solve_status'] in _SOLVED_STATUS:
                 self.__portf_w_list.append( cur_res['portf_w'] )
             else:
                 self.__portf_w_list.append( self.__portf_w_list[-1] )
@@ -138,12 +193,15 @@ class meanvarOptStrat:
     def _get_meanvar_data_params(self) -> Any:
         '''
         return:
-            train_rtn_mat_list: list of ndarray
+            rtn_data: ndarray, panel from back_window_size days before begindate to termidate
+            rebal_idx: ndarray, column of every rebalance day in rtn_data
+            panel_key: tuple, identity of the panel for the estimator cache
             hold_rtn_mat_list: list of ndarray
             assets_idlst: list of str
             constraints: list of ndarray or none
             mvo_target: str
             expt_tgt_value: npfloat
+            group_constraints: [member_lst, low, high] of categories / asset groups or none
         '''
         assets_info_lst = self.__inputs["assets_info"] # assets_info
 
@@ -162,8 +220,8 @@ class meanvarOptStrat:
         tbl_names = list( src_tbl_dict.keys() ) # list of str
         assets_ids = [ src_tbl_dict[tbl] for tbl in tbl_names] # list of lists
 
-        train_rtn_mat_list, hold_rtn_mat_list, assets_idlst = \
-            get_train_hold_rtn_data(
+        rtn_data, rebal_idx, hold_rtn_mat_list, assets_idlst = \
+            get_panel_hold_rtn_data(
                 begindate,
                 termidate,
                 gapday,
@@ -175,10 +233,158 @@ class meanvarOptStrat:
                 _MKT_DATE_TABLE
             )
         
+        # 面板由资产、表、区间与膨胀系数确定, 加上窗口与调仓周期作为估计缓存的 key, 不必对数据求摘要
+        panel_key = (tuple(assets_idlst), tuple(tbl_names), begindate, termidate, dilate, back_window_size, gapday)
+
         constraints = get_constraints( assets_dict, assets_idlst )
 
-        return train_rtn_mat_list, hold_rtn_mat_list, assets_idlst, \
-               constraints, mvo_target, expt_tgt_value
+        # 类别/资产组的权重之和上下限, 可选
+        group_constraints = get_group_constraints(
+            assets_dict, assets_idlst, self.__inputs.get("category_info")
+            )
+
+        return rtn_data, rebal_idx, panel_key, hold_rtn_mat_list, assets_idlst, \
+               constraints, mvo_target, expt_tgt_value, group_constraints
+
+
+
+    def __build_rtn_provider(self, assets_idlst: t.List[str]) -> None:
+        '''
+        build the BlackLitterman provider once if inputs give views and no rtn_provider was given.
+        views are ordered by assets_idlst, so it is built after the first data loading
+        '''
+        if self.__rtn_provider is not None:
+            return
+
+        assets_dict, _ = parseAssets2dicts(self.__inputs["assets_info"])
+        bl_params = get_bl_params(assets_dict, assets_idlst, self.__inputs)
+        if bl_params is not None:
+            # 收益率膨胀 dilate 倍时, 协方差膨胀 dilate^2 倍: 观点收益率乘 dilate, 风险厌恶系数除以 dilate
+            self.__rtn_provider = blackLittermanRtnProvider(
+                bl_params['view_pick_mat'],
+                bl_params['view_rtn_vec'] * dilate,
+                bl_params['risk_avers_factor'] / dilate,
+                bl_params['equi_wght_vec'],
+                bl_params['tau']
+                )
+
+
+
+    @staticmethod
+    def __solve_rolling_mvopt(
+        train_rtn_mat_list: t.List[np.ndarray],
+        assets_idlst: t.List[str],
+        constraints: t.List[t.Union[np.ndarray, None]],
+        mvo_target: str,
+        expt_tgt_value: np.floating,
+        qp_backend: str = 'cvxopt',
+        group_constraints: t.Union[list, None] = None,
+        rtn_provider: t.Union[t.Callable, None] = None,
+        window_moments: t.Union[t.List[tuple], None] = None,
+        rtn_key: t.Hashable = None
+        ) -> t.List[dict]:
+        '''
+        solve windows one by one, warm starting every qp from the previous window
+        window_moments: (mean, cov) of all windows from a covEstimator, or None for the sample estimates
+        rtn_key: identity of the windows' data passed to rtn_provider as panel_key
+        return:
+            list of de-dilated results of __solve_single_mvopt (without qp_solution)
+        '''
+        # 各窗口的上下限约束相同, 二次规划的不等式约束 G, h 只构建一次.
+        # box 后端的 minWave, cla 后端的 minWave / maxReturn 不需要
+        no_ineq_qp = (qp_backend == 'box' and mvo_target == 'minWave') or \
+            (qp_backend == 'cla' and mvo_target in ('minWave', 'maxReturn'))
+        ineq_qp_args = None if no_ineq_qp else \
+            MeanVarOpt.build_ineq_qp_args(constraints, group_constraints, len(assets_idlst))
+        # 相邻窗口重叠 back_window_size - gapday 天, 用上一窗口的 primal/dual 解热启动
+        qp_initvals = None
+        if window_moments is None:
+            window_moments = [None] * len(train_rtn_mat_list)
+
+        solve_res_list = []
+        for i, (train_rtn_mat, moments) in enumerate(zip(train_rtn_mat_list, window_moments)):
+
+            cur_res = meanvarOptStrat.__solve_single_mvopt(
+                train_rtn_mat,
+                assets_idlst,
+                constraints,
+                mvo_target,
+                expt_tgt_value,
+                ineq_qp_args,
+                qp_initvals,
+                qp_backend,
+                group_constraints,
+                rtn_provider,
+                i + 1,
+                moments,
+                rtn_key
+                )
+
+            qp_solution = cur_res.pop('qp_solution')
+            # 闭式解直接可行的窗口没有二次规划解, 沿用之前的热启动点
+            if cur_res['solve_status'] in _SOLVED_STATUS and qp_solution is not None:
+                qp_initvals = qp_solution
+
+            solve_res_list.append(cur_res)
+
+        return solve_res_list
+
+
+
+    @staticmethod
+    def __solve_batch_mvopt(
+        train_rtn_stack: np.ndarray,
+        assets_idlst: t.List[str],
+        mvo_target: str,
+        expt_tgt_value: np.floating,
+        rtn_provider: t.Union[t.Callable, None] = None,
+        window_moments: t.Union[t.List[tuple], None] = None,
+        rtn_key: t.Hashable = None
+        ) -> t.List[dict]:
+        '''
+        solve all unbounded windows in one batched closed-form computation
+        input:
+            train_rtn_stack: shape (num_windows, num_assets, back_window_size)
+            window_moments: (mean, dense cov) of all windows from a covEstimator, or None for the sample estimates
+            rtn_key: identity of the windows' data passed to rtn_provider as panel_key
+        return:
+            list of de-dilated results, same as __solve_single_mvopt (without qp_solution)
+        '''
+        if window_moments is None:
+            expct_rtn_stack, cov_stack = None, None
+        else:
+            expct_rtn_stack = np.stack([mean for mean, _ in window_moments], axis=0)
+            cov_stack = np.stack([cov_mat for _, cov_mat in window_moments], axis=0)
+
+        if rtn_provider is not None:
+            expct_rtn_stack = np.stack([
+                rtn_provider(i + 1, train_rtn_mat, None if cov_stack is None else cov_stack[i], rtn_key)
+                for i, train_rtn_mat in enumerate(train_rtn_stack)
+                ], axis=0)
+
+        solve_res_list = MeanVarOpt.solve_unbounds_batch(
+            train_rtn_stack,
+            expt_tgt_value,
+            mvo_target,
+            assets_idlst,
+            expct_rtn_stack,
+            cov_stack
+            )
+
+        for res in solve_res_list:
+            if res['solve_status'].startswith('FAIL_'):
+                print(res['solve_status'])
+                res['portf_rtn'], res['portf_var'] = 0, -dilate
+
+        return [meanvarOptStrat.__de_dilate_res(res) for res in solve_res_list]
+
+
+
+    @staticmethod
+    @addSTD('portf_var')
+    @deDilate(dilate)
+    def __de_dilate_res(res: dict) -> Any:
+        return res
 
 
 
@@ -191,6 +397,14 @@ class meanvarOptStrat:
         constraints: t.List[t.Union[np.ndarray, None]],
         mvo_target: str,
         expt_tgt_value: np.floating,
+        ineq_qp_args: t.Union[list, None] = None,
+        qp_initvals: t.Union[dict, None] = None,
+        qp_backend: str = 'cvxopt',
+        group_constraints: t.Union[list, None] = None,
+        rtn_provider: t.Union[t.Callable, None] = None,
+        position_no: t.Union[int, None] = None,
+        moments: t.Union[t.Tuple[np.ndarray, np.ndarray], None] = None,
+        rtn_key: t.Hashable = None
         ) -> Any:
         '''
         input:
@@ -199,6 +413,15 @@ class meanvarOptStrat:
             constraints: t.List[t.Union[np.ndarray, None]],
             mvo_target: str,
             expt_tgt_value: np.floating,
+            ineq_qp_args: prebuilt [G, h] of MeanVarOpt, or None
+            qp_initvals: primal/dual solution to warm start the qp, or None
+            qp_backend: 'cvxopt', 'box' or 'cla', solver of bounded problems
+            group_constraints: [member_lst, low, high] of categories / asset groups, or None
+            rtn_provider: expected-return provider, or None for the sample mean
+            position_no: window number passed to rtn_provider, starts from 1
+            moments: (mean, cov) of train_rtn_mat from a covEstimator, or None for the sample estimates.
+                cov may be a factorCovariance
+            rtn_key: identity of the window's data passed to rtn_provider as panel_key, or None
         return:
         de-dilate
             portf_w: np.ndarray
@@ -207,15 +430,23 @@ class meanvarOptStrat:
             portf_std: np.floating
             solve_status: str
             assets_idlst: list
+            qp_iterations: int
+            qp_solution: dict or None
         '''
 
-        cov_mat = np.cov(train_rtn_mat)
-        rtn_rates = train_rtn_mat.mean(axis=1)
+        sample_mean, cov_mat = (train_rtn_mat.mean(axis=1), np.cov(train_rtn_mat)) if moments is None else moments
+        # 收益率 provider(如 BL 后验)需要稠密协方差
+        rtn_rates = sample_mean if rtn_provider is None else \
+            rtn_provider(position_no, train_rtn_mat, cov_mat.to_dense() if hasattr(cov_mat, 'to_dense') else cov_mat,
+                         rtn_key)
         
         try:
-            fin = MeanVarOpt(rtn_rates, cov_mat, constraints, assets_idlst)
+            fin = MeanVarOpt(rtn_rates, cov_mat, constraints, assets_idlst, ineq_qp_args, qp_backend,
+                             group_constraints)
             
-            res = fin(expt_tgt_value, mvo_target)
+            res = fin(expt_tgt_value, mvo_target, qp_initvals)
+
+            res['qp_solution'] = fin.qp_solution
             
         except Exception as e:
             traceback.print_exc()
@@ -225,7 +456,9 @@ class meanvarOptStrat:
                 'portf_rtn': 0,
                 'portf_var': -dilate,
                 'solve_status': 'FAIL_' + str(e),
-                'assets_idlst': assets_idlst
+                'assets_idlst': assets_idlst,
+                'qp_iterations': 0,
+                'qp_solution': None
                 }
         
         return res
@@ -242,27 +475,38 @@ class meanvarOptStrat:
         "position_no": int, starts from 1
         "train_rtn_mat": np.ndarray
         "constraints": list of None or np.ndarray
+        "group_constraints": [member_lst, low, high] or None
         "mvo_target": str
         "expt_tgt_value": np.floating
         "solve_res": basicPortfSolveRes
         "hold_rtn_mat": np.ndarray
         '''
 
-        train_rtn_mat_list, hold_rtn_mat_list, assets_idlst, constraints, flag,\
-            expt_tgt_value = self._get_meanvar_data_params()
+        rtn_data, rebal_idx, panel_key, hold_rtn_mat_list, assets_idlst, constraints, flag,\
+            expt_tgt_value, group_constraints = self._get_meanvar_data_params()
+        self.__build_rtn_provider(assets_idlst)
         
-        assert position_no <= len(train_rtn_mat_list), \
-            f"position_no must no larger than {len(train_rtn_mat_list)}"
+        assert position_no <= len(rebal_idx), \
+            f"position_no must no larger than {len(rebal_idx)}"
 
-        train_rtn_mat = train_rtn_mat_list[position_no-1]
+        rebal = rebal_idx[position_no-1]
+        train_rtn_mat = rtn_data[:, rebal-back_window_size:rebal]
 
         cur_res = self.__solve_single_mvopt(
             train_rtn_mat,
             assets_idlst,
             constraints,
             flag,
-            expt_tgt_value
+            expt_tgt_value,
+            qp_backend=self.__qp_backend,
+            group_constraints=group_constraints,
+            rtn_provider=self.__rtn_provider,
+            position_no=position_no,
+            # 与 backtest 相同的面板, 直接命中估计器缓存; 未命中时只估计这一个窗口
+            moments=self.__cov_estimator(rtn_data, rebal_idx, back_window_size, panel_key, position_no-1),
+            rtn_key=(panel_key, self.__cov_estimator.key)
             )
+        cur_res.pop('qp_solution')
         
         hold_rtn_mat = hold_rtn_mat_list[position_no-1] / dilate
 
@@ -270,6 +514,7 @@ class meanvarOptStrat:
             "position_no": position_no,
             "train_rtn_mat": train_rtn_mat,
             "constraints": constraints,
+            "group_constraints": group_constraints,
             "mvo_target": flag,
             "expt_tgt_value": expt_tgt_value,
             "solve_res": cur_res,
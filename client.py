@@ -24,7 +24,7 @@ inputs = {
         #                   [0,0,0,0,1]],
           # "tgt_contrib_ratio":[0.5, 0.3, 0.2],
           # "assets_idx":["000001.SH", "000016.SH", "000002.SH", "000009.SH", "000010.SH"],
-          "mvo_target":"maxReturn", # minWave: get min var from given r; maxReturn: get max r from given var; sharp: max shap ratio
+          "mvo_target":"maxReturn", # minWave: get min var from given r; maxReturn: get max r from given var; sharp: max sharpe ratio given risk-free rate as expt_tgt_value
           "expt_tgt_value":0.3,
           "rtn_dilate":100,
           "begindate":"20230301",
@@ -32,6 +32,7 @@ inputs = {
           "gapday":10,
           "back_window_size":30,
           "benchmark":"CSI800",
+          # "category_info":[{"category":"index", "lower_bound":'', "upper_bound":0.6}], # 类别/资产组权重之和的上下限, 资产组用 "assets":[ids]
           "assets_info":[
               {
                 "id":"000001.SH",